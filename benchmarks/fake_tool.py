@@ -0,0 +1,209 @@
+import json
+import math
+import os
+import sys
+import time
+
+# Deterministic stand-in for ffmpeg, ffprobe, dovi_tool and mkvmerge, used by run_benchmarks.py.
+# Media files are a one-line JSON header ("FAKEMEDIA {...}") padded with zeros to the size the
+# real file would have, so every stage reads and writes realistic amounts of data without
+# decoding anything. Usage: fake_tool.py <tool> <arguments of the real tool>
+#
+# Throughput is set through the environment:
+#   REDOVI_FAKE_ENCODE_FPS      frames per second of an encoder that has the whole machine (2000)
+#   REDOVI_FAKE_IO_MBPS         read/write throughput of every tool in MB/s, 0 = unthrottled (0)
+#   REDOVI_FAKE_ENCODED_RATIO   encoded video size relative to the source video at quality 23 (0.25);
+#                               every 6 quality steps halve or double it, like CRF does
+#   REDOVI_FAKE_ENCODERS        encoders listed by "ffmpeg -encoders" (libx265,hevc_nvenc,hevc_qsv)
+#   REDOVI_FAKE_HWACCELS        hwaccels listed by "ffmpeg -hwaccels" (cuda,qsv)
+
+HEADER = b"FAKEMEDIA "
+CHUNK_SIZE = 1024 * 1024
+# One UNSPEC62 NAL unit per frame: the first profile 8.1 RPU of tests/fixtures/p81.bin
+RPU_FRAME = bytes.fromhex(
+    "000000017c0119080908406136506e8002037f801ffc00fffa8000004000001fe0000a810000fc000084000056000004"
+    "100003fc0001040000ff00004100003fc0001040001080000fe00004200003f80001080000fe00004200004300003f40"
+    "0010c0000fd00004300003f400010c0000ac000008200007f80002080001fe00008200007f80002080002100001fc000"
+    "08400007f00002100001fc00008400008600007e80002180001fa00008600007e800021800034400000300064c84001f"
+    "405e208400076c20000020000003010000030001000003000386c4486030c14bc611c0a280000034c7cb5fffe0000003"
+    "000003000003000c040fb9c02a60300800603a668090603e8003203e8019001b814b5f80"
+)
+
+ENCODE_FPS = float(os.environ.get("REDOVI_FAKE_ENCODE_FPS", "2000"))
+IO_MBPS = float(os.environ.get("REDOVI_FAKE_IO_MBPS", "0"))
+ENCODED_RATIO = float(os.environ.get("REDOVI_FAKE_ENCODED_RATIO", "0.25"))
+ENCODERS = os.environ.get("REDOVI_FAKE_ENCODERS", "libx265,hevc_nvenc,hevc_qsv").split(",")
+HWACCELS = os.environ.get("REDOVI_FAKE_HWACCELS", "cuda,qsv").split(",")
+
+# Keeps reads and writes at IO_MBPS
+class Throttle:
+    def __init__(self):
+        self.start = time.monotonic()
+        self.done = 0
+
+    def account(self, num_bytes):
+        self.done += num_bytes
+        if IO_MBPS:
+            ahead = self.done / (IO_MBPS * 1024 * 1024) - (time.monotonic() - self.start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+def open_input(path):
+    return sys.stdin.buffer if path == "-" else open(path, "rb")
+
+# Header of a fake media file; the rest of the file is read to cost the same I/O as the real tool
+def read_media(path, throttle):
+    f = open_input(path)
+    line = f.readline()
+    if not line.startswith(HEADER):
+        sys.exit(f"{path}: not a media file")
+    for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+        throttle.account(len(block))
+    return json.loads(line[len(HEADER):])
+
+def write_media(path, info, size, throttle):
+    f = sys.stdout.buffer if path == "-" else open(path, "wb")
+    line = HEADER + json.dumps(info).encode() + b"\n"
+    f.write(line)
+    remaining = max(0, size - len(line))
+    zeros = bytes(CHUNK_SIZE)
+    while remaining > 0:
+        block = min(remaining, CHUNK_SIZE)
+        f.write(zeros[:block])
+        throttle.account(block)
+        remaining -= block
+    f.flush()
+    if path != "-":
+        f.close()
+
+def option(args, name, default=None):
+    return args[args.index(name) + 1] if name in args else default
+
+def last_option(args, name):
+    values = [args[i + 1] for i, arg in enumerate(args[:-1]) if arg == name]
+    return values[-1] if values else None
+
+def ffprobe(args):
+    info = read_media(args[-1], Throttle())
+    fps = info["fps"]
+    start = info.get("start", 0) # Container start time; packet timestamps are absolute
+    if "packet=pts_time,flags" in args:
+        for i in range(info["frames"]):
+            print(f"{start + i / fps:.6f},{'K_' if i % info['gop'] == 0 else '__'}")
+        return
+    streams = [{
+        "index": 0, "codec_type": "video", "codec_name": "hevc", "width": 3840, "height": 2160,
+        "avg_frame_rate": f"{fps}/1", "pix_fmt": "yuv420p10le",
+        "tags": {"NUMBER_OF_FRAMES": str(info["frames"])},
+        "side_data_list": [{"side_data_type": "DOVI configuration record", "dv_profile": 7}] if info["dovi"] else []
+    }]
+    for i, channels in enumerate(info["audio"]):
+        streams.append({"index": i + 1, "codec_type": "audio", "codec_name": "truehd", "channels": channels,
+                        "tags": {"language": "eng"}, "disposition": {"default": int(i == 0)}})
+    print(json.dumps({"streams": streams, "format": {"duration": str(info["frames"] / fps), "start_time": f"{start:.6f}"}, "chapters": []}))
+
+def encode(args, info, frames, output):
+    # libx265 shares the machine with the other segments of the title: pools=N gets N cores' worth
+    fps = ENCODE_FPS
+    x265 = dict(param.partition("=")[::2] for param in option(args, "-x265-params", "").split(":") if param)
+    pools = x265.get("pools")
+    if pools:
+        fps *= min(1.0, int(pools) / (os.cpu_count() or 1))
+    report = "-progress" in args
+    start = time.monotonic()
+    step = max(1, int(fps / 10)) # About ten updates per second
+    for frame in range(0, frames + 1, step):
+        time.sleep(max(0, frame / fps - (time.monotonic() - start)))
+        if report:
+            print(f"frame={frame}\nfps={fps:.1f}\nbitrate=20000.0kbits/s\nout_time_us={int(frame / info['fps'] * 1e6)}\nspeed={fps / info['fps']:.2f}x\nprogress=continue", flush=True)
+    if report:
+        print(f"frame={frames}\nfps={fps:.1f}\nbitrate=20000.0kbits/s\nout_time_us={int(frames / info['fps'] * 1e6)}\nspeed={fps / info['fps']:.2f}x\nprogress=end", flush=True)
+    quality = int(option(args, "-crf") or option(args, "-cq") or option(args, "-global_quality") or 23)
+    size = int(info["video_bytes"] * frames / info["frames"] * ENCODED_RATIO * 2 ** ((23 - quality) / 6))
+    write_media(output, dict(info, frames=frames, audio=[], video_bytes=size, quality=quality), size, Throttle())
+
+# libvmaf stand-in: the score falls with the quality value the sample was encoded at
+def vmaf(args):
+    info = read_media(args[args.index("-i") + 1], Throttle())
+    print(f"[libvmaf @ 0x0] VMAF score: {100 - (info['quality'] - 16) * 1.5:.6f}", file=sys.stderr)
+
+def ffmpeg(args):
+    if "-hwaccels" in args:
+        print("Hardware acceleration methods:\n" + "\n".join(HWACCELS))
+        return
+    if "-encoders" in args:
+        print("Encoders:\n V..... = Video\n ------")
+        for encoder in ["libx264"] + ENCODERS:
+            print(f" V....D {encoder:20} {encoder}")
+        return
+    if "lavfi" in args: # Capability test encode
+        sys.exit(0 if option(args, "-c:v") in ENCODERS else 1)
+    if "libvmaf" in option(args, "-lavfi", ""):
+        return vmaf(args)
+
+    throttle = Throttle()
+    info = read_media(option(args, "-i"), throttle)
+    output = args[-1]
+    first = 0
+    if "-ss" in args: # Seeks half a frame early, like the engine does
+        first = math.ceil(float(option(args, "-ss")) * info["fps"] - 1e-6)
+    frames = info["frames"] - first
+    if "-frames:v" in args:
+        frames = min(frames, int(option(args, "-frames:v")))
+
+    codec = last_option(args, "-c:v")
+    if option(args, "-f") == "matroska": # Side tracks: audio transcoded per track or copied
+        duration = int(info["frames"] / info["fps"])
+        copied_audio = info["video_bytes"] // 20 // max(1, len(info["audio"]))
+        channels = []
+        size = 0
+        for n in range(args.count("-map")):
+            if option(args, f"-c:{n}") == "aac":
+                channels.append(int(option(args, f"-ac:{n}")))
+                size += int(option(args, f"-b:{n}").rstrip("k")) * 1000 // 8 * duration
+            else:
+                channels.append(info["audio"][min(n, len(info["audio"]) - 1)])
+                size += copied_audio
+        write_media(output, dict(info, video_bytes=0, audio=channels), size, throttle)
+    elif codec in (None, "copy"):
+        size = info["video_bytes"] * frames // info["frames"]
+        write_media(output, dict(info, frames=frames, audio=[], video_bytes=size), size, throttle)
+    elif codec in ENCODERS:
+        encode(args, info, frames, output)
+    else:
+        sys.exit(f"Unknown encoder {codec}")
+
+def dovi_tool(args):
+    throttle = Throttle()
+    if "extract-rpu" in args:
+        source = option(args, "-i") or args[args.index("extract-rpu") + 1]
+        info = read_media(source, throttle)
+        if not info["dovi"]:
+            sys.stderr.write("Found no RPU\n")
+            sys.exit(1)
+        with open(option(args, "-o"), "wb") as f:
+            f.write(RPU_FRAME * info["frames"])
+    else: # inject-rpu
+        info = read_media(option(args, "-i"), throttle)
+        rpu_size = os.path.getsize(option(args, "--rpu-in"))
+        write_media(option(args, "-o"), info, info["video_bytes"] + rpu_size, throttle)
+
+def mkvmerge(args):
+    throttle = Throttle()
+    output = option(args, "-o")
+    inputs = [arg for i, arg in enumerate(args) if not arg.startswith("-") and args[i - 1] not in ("-o", "--language")]
+    merged = None
+    size = 0
+    for path in inputs:
+        info = read_media(path, throttle)
+        flag = args[args.index(path) - 1]
+        if merged is None:
+            merged = info
+            size += os.path.getsize(path)
+        elif flag != "--no-attachments": # Side tracks; with every track type disabled only chapters are taken
+            size += os.path.getsize(path)
+    write_media(output, dict(merged, dovi=True), size, throttle)
+
+if __name__ == "__main__":
+    tool, tool_args = sys.argv[1], sys.argv[2:]
+    {"ffprobe": ffprobe, "ffmpeg": ffmpeg, "dovi_tool": dovi_tool, "mkvmerge": mkvmerge}[tool](tool_args)
@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redovi_engine
+from redovi_engine import DEFAULT_SETTINGS, process_batch, reset_abort
+
+# Runs the real pipeline against fake_tool.py stand-ins and reports, per scenario, the wall time,
+# the time spent in every stage, the bytes written to temp and the peak temp disk usage.
+# Results are printed as JSON and, with --output, appended as one line to a .jsonl file so
+# runs can be compared over time.
+
+FAKE_TOOL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_tool.py")
+TOOLS = {"ffmpeg": "ffmpeg_path", "ffprobe": "ffprobe_path", "dovi_tool": "dovi_tool_path", "mkvmerge": "mkvmerge_path"}
+
+# Option overrides of each scenario; everything else comes from DEFAULT_SETTINGS
+SCENARIOS = {
+    "serial": {"pipeline_mode": "Temp Files", "parallel_files": 1},
+    "streamed": {"pipeline_mode": "Streamed", "parallel_files": 1},
+    "parallel": {"pipeline_mode": "Temp Files", "parallel_files": 3},
+    "parallel_streamed": {"pipeline_mode": "Streamed", "parallel_files": 3},
+    "segmented": {"pipeline_mode": "Streamed", "parallel_files": 1, "encoding_mode": "CPU", "encoding_quality": "medium", "cpu_segments": 4}
+}
+SAMPLE_INTERVAL = 0.05 # Seconds between temp folder scans
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the ReDoVi pipeline with fake tools.")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="Scenario to run (repeatable, default: all)")
+    parser.add_argument("--files", type=int, default=3, help="Sources per batch")
+    parser.add_argument("--frames", type=int, default=9600, help="Frames per source")
+    parser.add_argument("--frame-bytes", type=int, default=8192, help="Source video bytes per frame")
+    parser.add_argument("--encode-fps", type=float, default=2000, help="Fake encoder speed in frames per second")
+    parser.add_argument("--io-mbps", type=float, default=0, help="Fake tool read/write speed in MB/s, 0 = unthrottled")
+    parser.add_argument("--encode-profile", default="Standard", choices=list(redovi_engine.ENCODE_PROFILES), help="Encode profile of every scenario")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per scenario")
+    parser.add_argument("--work-dir", help="Folder for sources and outputs (default: a temporary folder)")
+    parser.add_argument("--output", help="Append the results as one JSON line to this file")
+    return parser.parse_args(argv)
+
+# Wrapper executables that start fake_tool.py as the named tool
+def install_fake_tools(tools_dir):
+    os.makedirs(tools_dir, exist_ok=True)
+    for tool, attribute in TOOLS.items():
+        if os.name == "nt":
+            path = os.path.join(tools_dir, tool + ".cmd")
+            content = f'@"{sys.executable}" "{FAKE_TOOL}" {tool} %*\r\n'
+        else:
+            path = os.path.join(tools_dir, tool)
+            content = f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_TOOL}" {tool} "$@"\n'
+        with open(path, "w", newline="") as f:
+            f.write(content)
+        os.chmod(path, 0o755)
+        setattr(redovi_engine, attribute, path)
+
+# Point every file the engine keeps next to itself into the work folder, so benchmark runs never
+# touch the real caches and always start cold
+def isolate_engine_state(work_dir):
+    redovi_engine.stats_file = os.path.join(work_dir, "pipeline_stats.jsonl")
+    redovi_engine.probe_cache_file = os.path.join(work_dir, "probe_cache.json")
+    redovi_engine.capabilities_file = os.path.join(work_dir, "hw_capabilities.json")
+    redovi_engine.output_cache_file = os.path.join(work_dir, "output_cache.sqlite")
+    for path in (redovi_engine.probe_cache_file, redovi_engine.output_cache_file):
+        if os.path.exists(path):
+            os.remove(path)
+    redovi_engine.probe_cache = None
+    redovi_engine.capabilities = None
+
+def make_sources(source_dir, count, frames, frame_bytes):
+    os.makedirs(source_dir, exist_ok=True)
+    sources = []
+    for i in range(count):
+        path = os.path.join(source_dir, f"title{i + 1}.mkv")
+        video_bytes = frames * frame_bytes
+        audio_bytes = video_bytes // 20
+        info = {"frames": frames, "fps": 24, "gop": 48, "dovi": True, "audio": [6], "video_bytes": video_bytes}
+        with open(path, "wb") as f:
+            f.write(b"FAKEMEDIA " + json.dumps(info).encode() + b"\n")
+            f.truncate(video_bytes + audio_bytes) # Sparse where the filesystem supports it
+        sources.append(path)
+    return sources
+
+# Polls the temp folder: the largest size every file reached adds up to the bytes written to temp,
+# and the largest total at any one time is the peak disk usage
+class TempMonitor:
+    def __init__(self, folder):
+        self.folder = folder
+        self.file_sizes = {}
+        self.peak_bytes = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def scan(self):
+        total = 0
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue # Removed while scanning
+                total += size
+                self.file_sizes[path] = max(size, self.file_sizes.get(path, 0))
+        self.peak_bytes = max(self.peak_bytes, total)
+
+    def run(self):
+        while not self.stop_event.wait(SAMPLE_INTERVAL):
+            self.scan()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+
+    @property
+    def bytes_written(self):
+        return sum(self.file_sizes.values())
+
+def run_scenario(name, sources, work_dir, run_index, encode_profile="Standard"):
+    isolate_engine_state(work_dir)
+    reset_abort()
+    output_folder = os.path.join(work_dir, f"out_{name}_{run_index}")
+    shutil.rmtree(output_folder, ignore_errors=True)
+    os.makedirs(output_folder)
+    options = dict(DEFAULT_SETTINGS, output_cache="Off", failed_temp="Delete Temp", encode_profile=encode_profile, **SCENARIOS[name])
+
+    stages = {}
+    failures = []
+    lock = threading.Lock()
+    def on_event(event):
+        with lock:
+            if event["event"] == "stage_end":
+                stage = stages.setdefault(event["stage"], {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+                stage["count"] += 1
+                stage["total_seconds"] += event["seconds"]
+                stage["max_seconds"] = max(stage["max_seconds"], event["seconds"])
+            elif event["event"] == "file_failed":
+                failures.append({"file": os.path.basename(event["file"]), "error": event["error"]})
+
+    start = time.monotonic()
+    with TempMonitor(os.path.join(output_folder, "temp")) as monitor:
+        processed, total, _ = process_batch(sources, output_folder, options, on_event)
+    wall = time.monotonic() - start
+    monitor.scan()
+
+    for stage in stages.values():
+        stage["total_seconds"] = round(stage["total_seconds"], 3)
+    return {
+        "scenario": name,
+        "run": run_index,
+        "options": SCENARIOS[name],
+        "wall_seconds": round(wall, 3),
+        "files": total,
+        "processed": processed,
+        "failures": failures,
+        "stages": stages,
+        "temp_bytes_written": monitor.bytes_written,
+        "peak_temp_bytes": monitor.peak_bytes,
+        "output_bytes": sum(os.path.getsize(os.path.join(output_folder, f)) for f in os.listdir(output_folder) if f.endswith(".mkv"))
+    }
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    os.environ["REDOVI_FAKE_ENCODE_FPS"] = str(args.encode_fps)
+    os.environ["REDOVI_FAKE_IO_MBPS"] = str(args.io_mbps)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="redovi_bench_")
+    try:
+        install_fake_tools(os.path.join(work_dir, "tools"))
+        sources = make_sources(os.path.join(work_dir, "sources"), args.files, args.frames, args.frame_bytes)
+        results = []
+        for name in args.scenario or list(SCENARIOS):
+            for run_index in range(args.repeat):
+                result = run_scenario(name, sources, work_dir, run_index, args.encode_profile)
+                print(f"{name} #{run_index}: {result['wall_seconds']:.2f}s, peak temp {redovi_engine.format_size(result['peak_temp_bytes'])}", file=sys.stderr, flush=True)
+                results.append(result)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "time": time.time(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "files": args.files,
+            "frames": args.frames,
+            "frame_bytes": args.frame_bytes,
+            "encode_fps": args.encode_fps,
+            "io_mbps": args.io_mbps,
+            "encode_profile": args.encode_profile
+        },
+        "results": results
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(report) + "\n")
+    return 0 if all(not result["failures"] for result in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+import argparse
+import glob
+import json
+import os
+import signal
+import sys
+import threading
+
+import redovi_engine
+from redovi_engine import (DEFAULT_SETTINGS, PIPELINE_MODES, QUALITY_PRESETS, load_settings, find_video_files, format_size, format_progress_stats,
+                           process_batch, watch_folder, analyze_quality, detect_capabilities, benchmark_profiles, select_encode_profile,
+                           enqueue_jobs, run_job_queue, query_jobs, job_counts, set_job_priority, cancel_job, retry_job, clear_jobs)
+
+# Command-line entry point for headless encode nodes. Takes the same options the GUI keeps in
+# config.json; flags override the config file, which overrides the defaults.
+
+# Read the way ffmpeg will, so a bitrate it can't use fails here instead of in every job
+def bitrate_arg(value):
+    try:
+        redovi_engine.parse_bitrate(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="redovi", description="Re-encode Dolby Vision video and keep its RPU metadata.")
+    parser.add_argument("inputs", nargs="*", help="Video files, folders or glob patterns (** matches subfolders)")
+    parser.add_argument("-o", "--output-folder", help="Output folder (default: next to each source)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Search folders recursively")
+    parser.add_argument("--watch", action="store_true", help="Keep watching the input folder and process new or changed files once they are fully copied")
+    parser.add_argument("--watch-interval", type=float, default=redovi_engine.WATCH_INTERVAL, help="Seconds between scans in watch mode")
+    parser.add_argument("--enqueue", action="store_true", help="Add the inputs to the job queue with the given settings instead of processing them")
+    parser.add_argument("--priority", type=int, default=0, help="Priority of --enqueue jobs; higher runs first")
+    parser.add_argument("--run-queue", action="store_true", help="Work through the job queue until it is empty")
+    parser.add_argument("--keep-running", action="store_true", help="With --run-queue, keep waiting for new jobs when the queue is empty")
+    parser.add_argument("--queue-status", action="store_true", help="Print the job counts and the running, waiting and failed jobs")
+    parser.add_argument("--set-priority", nargs=2, type=int, metavar=("JOB", "PRIORITY"), help="Change the priority of a queued job")
+    parser.add_argument("--cancel-job", type=int, metavar="JOB", help="Cancel a queued job")
+    parser.add_argument("--retry-job", type=int, metavar="JOB", help="Queue a failed or cancelled job again")
+    parser.add_argument("--clear-jobs", action="store_true", help="Remove done and cancelled jobs from the queue")
+    parser.add_argument("--config", help="Settings file in the GUI's config.json format")
+    parser.add_argument("--json", action="store_true", help="Print progress as JSON lines")
+    parser.add_argument("--quality", type=int, help="CQ/CRF value (16-40)")
+    parser.add_argument("--auto-quality", dest="auto_quality", choices=redovi_engine.AUTO_QUALITY_MODES, help="Pick the quality from sampled encodes for a target size or VMAF")
+    parser.add_argument("--target-size-gb", dest="target_size_gb", type=float, help="Video size of the whole title for --auto-quality Size")
+    parser.add_argument("--target-vmaf", dest="target_vmaf", type=float, help="Lowest mean VMAF for --auto-quality VMAF")
+    parser.add_argument("--analyze", action="store_true", help="Only print the quality --auto-quality would pick, don't encode")
+    parser.add_argument("--encoding-mode", dest="encoding_mode", choices=list(QUALITY_PRESETS))
+    parser.add_argument("--preset", dest="encoding_quality", help="Encoder preset")
+    parser.add_argument("--encode-profile", dest="encode_profile", choices=list(redovi_engine.ENCODE_PROFILES) + ["Auto"], help="Encoder parameter set; Auto uses the fastest one --benchmark-profiles measured on this host")
+    parser.add_argument("--benchmark-profiles", action="store_true", help="Time every encode profile on a sample of the first input and remember the results for --encode-profile Auto")
+    parser.add_argument("--audio-channels", dest="audio_channels", choices=["No", "2.0 Stereo", "5.1 Surround", "7.1 Surround"])
+    parser.add_argument("--audio-bitrate", dest="audio_bitrate", type=bitrate_arg, help="AAC bitrate in ffmpeg's syntax, e.g. 640k")
+    parser.add_argument("--keep-original-audio", dest="keep_original_audio", choices=["Keep", "Remove"])
+    parser.add_argument("--pipeline-mode", dest="pipeline_mode", choices=PIPELINE_MODES)
+    parser.add_argument("--failed-temp", dest="failed_temp", choices=["Keep Temp", "Delete Temp"])
+    parser.add_argument("--cpu-segments", dest="cpu_segments", type=int)
+    parser.add_argument("--parallel-files", dest="parallel_files", type=int)
+    parser.add_argument("--scratch-folder", dest="scratch_folder", help="Folder for temp files (default: temp in the output folder)")
+    parser.add_argument("--output-cache", dest="output_cache", choices=["Reuse", "Off"], help="Link an earlier identical encode instead of encoding again")
+    parser.add_argument("--refresh-hardware", action="store_true", help="List the hwaccels and encoders again instead of using the cached lists")
+    return parser.parse_args(argv)
+
+def collect_inputs(inputs, recursive):
+    files = []
+    for pattern in inputs:
+        matches = glob.glob(pattern, recursive=True) if glob.has_magic(pattern) else [pattern]
+        for path in sorted(matches):
+            if os.path.isdir(path):
+                files.extend(find_video_files(path, recursive))
+            elif path.lower().endswith(redovi_engine.VIDEO_EXTENSIONS):
+                files.append(path)
+    # Same file given twice (e.g. a folder and a glob inside it) is processed once
+    return list(dict.fromkeys(os.path.abspath(f) for f in files))
+
+# Events arrive from the engine's worker threads; one lock keeps output lines whole
+print_lock = threading.Lock()
+
+def print_json_event(event):
+    with print_lock:
+        print(json.dumps(event), flush=True)
+
+def print_event(event):
+    with print_lock:
+        print_text_event(event)
+
+def print_text_event(event):
+    kind = event["event"]
+    name = os.path.basename(event.get("file", ""))
+    if kind == "progress":
+        stats = format_progress_stats(event)
+        print(f"[{event['percent']:5.1f}%] {name}: {event['message']}{' ' + stats if stats else ''}", flush=True)
+    elif kind == "file_done":
+        print(f"Done: {name} -> {event['output']}", flush=True)
+    elif kind == "file_failed":
+        print(f"Failed: {name}: {event['error']}", file=sys.stderr, flush=True)
+    elif kind == "encoder_fallback":
+        print(f"{name}: {event['requested']} is not available, encoding with {event['mode']}", flush=True)
+    elif kind == "file_cached":
+        print(f"Cached: {name} -> {event['output']} (same source and settings as {event['cached_output']})", flush=True)
+    elif kind == "batch_done" and event.get("report"):
+        print(f"Report: {event['report']}", flush=True)
+    elif kind == "file_skipped":
+        print(f"Skipped (already done): {name}", flush=True)
+    elif kind == "quality_tuned":
+        vmaf = f", VMAF {event['vmaf']:.1f}" if "vmaf" in event else ""
+        met = "" if event["met"] else f" (the {event['target'].lower()} target can't be met)"
+        print(f"{name}: quality {event['quality']} with {event['encoding_mode']}, about {format_size(event['predicted_bytes'])} of video{vmaf}{met}", flush=True)
+    elif kind == "profile_benchmarked":
+        print(f"{event['mode']} {event['profile']}: {event['fps']:.1f} fps", flush=True)
+    elif kind == "file_queued":
+        print(f"Queued: {name}", flush=True)
+    elif kind == "watch_start":
+        print(f"Watching {event['folder']} every {event['interval']:g}s, Ctrl+C to stop", flush=True)
+    elif kind == "watch_done":
+        print(f"Stopped watching: {event['processed']} processed, {event['failed']} failed", flush=True)
+    elif kind == "job_claimed":
+        print(f"Job {event['job']}: {name} (attempt {event['attempt']}, priority {event['priority']})", flush=True)
+    elif kind == "job_retry":
+        print(f"Job {event['job']}: {name} failed, retrying in {event['retry_in']}s", flush=True)
+    elif kind == "queue_done":
+        print(f"Queue: {event['processed']} processed, {event['failed']} failed, {event['counts']['queued']} still queued", flush=True)
+        for path in event["reports"]:
+            print(f"Report: {path}", flush=True)
+
+QUEUE_STATUS_WAITING = 20 # Queued jobs listed by --queue-status, next to claim first
+
+def print_queue_status(as_json):
+    counts = job_counts()
+    jobs = query_jobs("running") + query_jobs("queued", limit=QUEUE_STATUS_WAITING) + query_jobs("failed")
+    if as_json:
+        print(json.dumps({"counts": counts, "jobs": [{key: value for key, value in job.items() if key != "options"} for job in jobs]}))
+        return
+    print(", ".join(f"{count} {status}" for status, count in counts.items()))
+    for job in jobs:
+        detail = f" ({job['error']})" if job["status"] == "failed" else ""
+        print(f"{job['id']:>6} {job['status']:8} p{job['priority']:<3} attempt {job['attempts']}/{job['max_attempts']} {job['source']}{detail}")
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    options = dict(DEFAULT_SETTINGS)
+    options.update(load_settings(args.config))
+    options.update({key: value for key, value in vars(args).items() if key in DEFAULT_SETTINGS and value is not None})
+    if not 16 <= int(options["quality"]) <= 40:
+        print("Quality must be between 16-40", file=sys.stderr)
+        return 2
+
+    # Queue management needs no inputs
+    if args.set_priority or args.cancel_job is not None or args.retry_job is not None or args.clear_jobs:
+        changed = True
+        if args.set_priority:
+            changed = set_job_priority(*args.set_priority) and changed
+        if args.cancel_job is not None:
+            changed = cancel_job(args.cancel_job) and changed
+        if args.retry_job is not None:
+            changed = retry_job(args.retry_job) and changed
+        if args.clear_jobs:
+            print(f"Removed {clear_jobs()} finished jobs", flush=True)
+        if not changed:
+            print("No such job in a state that allows this", file=sys.stderr)
+            return 1
+        if not args.queue_status and not args.run_queue:
+            return 0
+    if args.queue_status and not args.run_queue:
+        print_queue_status(args.json)
+        return 0
+
+    if args.watch and (len(args.inputs) != 1 or not os.path.isdir(args.inputs[0])):
+        print("--watch needs exactly one input folder", file=sys.stderr)
+        return 2
+
+    if args.watch and args.benchmark_profiles:
+        print("--benchmark-profiles needs an input file, not --watch", file=sys.stderr)
+        return 2
+
+    input_files = [] if args.watch else collect_inputs(args.inputs, args.recursive)
+    if args.enqueue:
+        if not input_files:
+            print("No video files found.", file=sys.stderr)
+            return 2
+        job_ids = enqueue_jobs(input_files, args.output_folder, options, args.priority)
+        print(json.dumps({"jobs": job_ids}) if args.json else f"Queued {len(job_ids)} jobs", flush=True)
+        if not args.run_queue:
+            return 0
+    if not input_files and not args.watch and not args.run_queue:
+        print("No video files found.", file=sys.stderr)
+        return 2
+
+    on_event = print_json_event if args.json else print_event
+    if args.refresh_hardware:
+        detect_capabilities(refresh=True)
+
+    # Ctrl+C / SIGTERM stop the running tools like the GUI's Abort button
+    signal.signal(signal.SIGINT, lambda *_: redovi_engine.request_abort())
+    signal.signal(signal.SIGTERM, lambda *_: redovi_engine.request_abort())
+
+    if args.run_queue:
+        _, failed = run_job_queue(options, on_event, args.keep_running)
+        if args.queue_status:
+            print_queue_status(args.json)
+        return 130 if redovi_engine.abort_requested() else (1 if failed else 0)
+
+    if args.benchmark_profiles:
+        try:
+            results = benchmark_profiles(input_files[0], options, on_event)
+        except Exception as e:
+            print(f"Failed: {os.path.basename(input_files[0])}: {e}", file=sys.stderr, flush=True)
+            return 130 if redovi_engine.abort_requested() else 1
+        for mode in results:
+            print(f"Auto profile with {mode}: {select_encode_profile('Auto', mode)}", flush=True)
+        return 0
+
+    if args.analyze:
+        failed = 0
+        for input_file in input_files:
+            try:
+                analyze_quality(input_file, options, on_event)
+            except Exception as e:
+                print(f"Failed: {os.path.basename(input_file)}: {e}", file=sys.stderr, flush=True)
+                failed += 1
+        return 130 if redovi_engine.abort_requested() else (1 if failed else 0)
+
+    if args.watch:
+        _, failed = watch_folder(os.path.abspath(args.inputs[0]), args.output_folder, options, on_event, args.recursive, args.watch_interval)
+        return 0 if not failed else 1
+
+    processed, total, _ = process_batch(input_files, args.output_folder, options, on_event)
+    if redovi_engine.abort_requested():
+        return 130
+    return 0 if processed == total else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
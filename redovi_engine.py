@@ -0,0 +1,2473 @@
+import os
+import errno
+import subprocess
+import shutil
+import threading
+import json
+import time
+import hashlib
+import platform
+import signal
+import sqlite3
+import re
+import tempfile
+from collections import deque
+from dataclasses import dataclass, field, fields, asdict
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from contextlib import contextmanager, closing
+
+from redovi_rpu import RpuError, read_rpu_profile, validate_profile, validate_frame_alignment
+
+# Define paths to the tools in the "tools" folder. Outside the bundled Windows build
+# (e.g. headless Linux encode nodes) the tools are taken from PATH instead.
+tools_dir = os.path.join(os.path.dirname(__file__), "tools")
+
+def find_tool(name):
+    bundled = os.path.join(tools_dir, name + (".exe" if os.name == "nt" else ""))
+    if os.path.exists(bundled):
+        return bundled
+    return shutil.which(name) or bundled
+
+dovi_tool_path = find_tool("dovi_tool")
+ffmpeg_path = find_tool("ffmpeg")
+mkvmerge_path = find_tool("mkvmerge")
+ffprobe_path = find_tool("ffprobe")
+
+# Keep console windows of the tools hidden on Windows (the flag doesn't exist elsewhere)
+NO_WINDOW = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+
+# Configuration file path
+config_file = os.path.join(os.path.dirname(__file__), "config.json")
+
+# Per-run timing / temp usage log, used to compare the pipeline modes
+stats_file = os.path.join(os.path.dirname(__file__), "pipeline_stats.jsonl")
+
+# Cached ffprobe results, keyed by source path and validated against size and mtime
+probe_cache_file = os.path.join(os.path.dirname(__file__), "probe_cache.json")
+PROBE_CACHE_MAX_ENTRIES = 5000
+
+# Seconds a tool gets to exit after SIGTERM before its process group is killed
+TERMINATE_TIMEOUT = 5
+TOOL_OUTPUT_TAIL = 20 # Last lines of a tool's console output kept for its error message
+
+# A tool that exited with an error; the message ends with the last lines it printed, which say why
+class ToolError(subprocess.CalledProcessError):
+    def __str__(self):
+        message = super().__str__()
+        output = self.stderr if isinstance(self.stderr, str) else ""
+        tail = "\n".join(output.strip().splitlines()[-TOOL_OUTPUT_TAIL:])
+        return f"{message}\n{tail}" if tail else message
+
+class Cancelled(Exception):
+    def __init__(self, message="Process aborted by user"):
+        super().__init__(message)
+
+# Cancellation of a job, or of everything below the root token. cancel() terminates every tool
+# started under the token or one of its children right away, so a blocking demux or remux stops
+# as promptly as the encode, and whatever waits on a slot or on scratch space gives up.
+class CancelToken:
+    def __init__(self, parent=None):
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.parent = parent
+        self.processes = []
+        self.children = []
+        if parent is not None:
+            with parent.lock:
+                parent.children.append(self)
+            if parent.cancelled:
+                self.cancel()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise Cancelled()
+
+    def cancel(self):
+        with self.lock:
+            self.event.set()
+            processes = [p for p in self.processes if p.returncode is None]
+            children = list(self.children)
+        for process in processes:
+            terminate_process(process)
+        for child in children:
+            child.cancel()
+
+    # A process started while the token was being cancelled is terminated at once
+    def register(self, process):
+        with self.lock:
+            self.processes = [p for p in self.processes if p.returncode is None]
+            self.processes.append(process)
+        if self.cancelled:
+            terminate_process(process)
+
+    # Detach a finished job from its parent
+    def close(self):
+        if self.parent is not None:
+            with self.parent.lock:
+                if self in self.parent.children:
+                    self.parent.children.remove(self)
+
+# Global variable to track if the process should be aborted; abort_token is the root of every job's token
+abort_process = False
+abort_token = CancelToken()
+cancel_state = threading.local()
+
+def request_abort():
+    global abort_process
+    abort_process = True
+    abort_token.cancel()
+
+def reset_abort():
+    global abort_process, abort_token
+    abort_process = False
+    abort_token = CancelToken()
+
+def abort_requested():
+    return abort_process
+
+# The token of the job the calling thread works for; the root token outside of jobs
+def current_cancel_token():
+    return getattr(cancel_state, "token", None) or abort_token
+
+@contextmanager
+def cancelling(token):
+    previous = getattr(cancel_state, "token", None)
+    cancel_state.token = token
+    try:
+        yield token
+    finally:
+        cancel_state.token = previous
+
+VIDEO_EXTENSIONS = ('.mkv', '.mp4')
+OUTPUT_SUFFIX = "_ReDoVi.mkv"
+
+# Watch mode: the folder is rescanned every WATCH_INTERVAL seconds, and a new or changed file is
+# only queued once its size and mtime held for WATCH_STABLE_SCANS scans (i.e. it is done copying)
+WATCH_INTERVAL = 10
+WATCH_STABLE_SCANS = 2
+
+# Pipeline modes. "Streamed" pipes the demux straight into dovi_tool, so the source-sized
+# _temp.hevc is never written; the encoded, injected, side track and remuxed files are in both.
+PIPELINE_MODES = ["Temp Files", "Streamed"]
+
+# Default concurrency limits for batch processing, overridable in config.json.
+# Files are processed in parallel and each stage waits for a slot on the resource it uses,
+# so one file can demux while another encodes and a third remuxes.
+DEFAULT_PARALLEL_FILES = 3
+DEFAULT_SLOT_LIMITS = {
+    "nvenc": 3,      # Concurrent NVENC sessions (consumer GeForce driver limit)
+    "qsv": 2,        # Concurrent Quick Sync sessions
+    "cpu_encode": 1, # libx265 already uses every core
+    "disk": 2        # Demux, RPU extraction, injection, audio and remux
+}
+ENCODER_RESOURCES = {"CUDA": "nvenc", "QSV": "qsv", "CPU": "cpu_encode"}
+
+# Encode profiles: parameter sets per mode on top of quality and preset. A profile only lists the
+# modes it changes anything for; elsewhere Standard is used. Every profile writes 10-bit main10,
+# which the DoVi base layer needs. "Auto" takes whichever of AUTO_PROFILES benchmarked
+# fastest on this host (benchmark_profiles); they differ in speed, not in output quality.
+#   decode         "software" keeps decoding on the CPU even where the GPU could decode
+#   lookahead      frames of rate control lookahead
+#   bframes        consecutive B-frames
+#   b_ref_mode     NVENC B-frames as references ("middle")
+#   spatial_aq     NVENC spatial adaptive quantization
+#   frame_threads  x265 frames encoded in parallel
+#   lookahead_threads  x265 threads for the lookahead
+ENCODE_PROFILES = {
+    "Standard": {
+        "CUDA": {},
+        "QSV": {},
+        "CPU": {}
+    },
+    "Software Decode": { # For GPUs whose decoder is slower than their encoder
+        "CUDA": {"decode": "software"},
+        "QSV": {"decode": "software"}
+    },
+    "Many Cores": { # x265 on hosts with more cores than its default threading keeps busy
+        "CPU": {"frame_threads": 6, "lookahead_threads": 4}
+    },
+    "High Quality": {
+        "CUDA": {"lookahead": 32, "bframes": 4, "b_ref_mode": "middle", "spatial_aq": True},
+        "QSV": {"lookahead": 40, "bframes": 4},
+        "CPU": {"lookahead": 40, "bframes": 8}
+    }
+}
+AUTO_PROFILES = ["Standard", "Software Decode", "Many Cores"]
+PROFILE_BENCHMARK_SECONDS = 10
+HW_DECODE_ARGS = {
+    "CUDA": ['-hwaccel', 'cuda', '-hwaccel_output_format', 'cuda', '-c:v', 'hevc_cuvid'],
+    "QSV": ['-hwaccel', 'qsv', '-hwaccel_output_format', 'qsv', '-c:v', 'hevc_qsv'] # Use QSV for decoding
+}
+
+# Hardware probe results, cached per host and ffmpeg build
+capabilities_file = os.path.join(os.path.dirname(__file__), "hw_capabilities.json")
+ENCODER_FALLBACK = ["CUDA", "QSV", "CPU"] # Fastest first; a mode that doesn't work falls back to the next
+MODE_ENCODERS = {"CUDA": "hevc_nvenc", "QSV": "hevc_qsv", "CPU": "libx265"}
+MODE_HWACCELS = {"CUDA": "cuda", "QSV": "qsv"}
+NVENC_PROBE_SESSIONS = 8 # Most concurrent sessions tried when measuring the NVENC limit
+
+# Per-file job manifest kept in the file's temp folder, and the batch state kept in the output folder
+JOB_MANIFEST_NAME = "job.json"
+BATCH_STATE_NAME = "redovi_batch.json"
+
+# Index of finished outputs, keyed by source fingerprint and encode settings, so an identical
+# source with identical settings is linked instead of encoded again
+output_cache_file = os.path.join(os.path.dirname(__file__), "output_cache.sqlite")
+OUTPUT_CACHE_MAX_ENTRIES = 10000 # Least recently used entries beyond this are dropped
+
+# Durable job queue shared by the GUI and headless workers. Every job keeps its source, output
+# folder and full option set, so jobs with different settings can wait in the same queue.
+job_queue_file = os.path.join(os.path.dirname(__file__), "job_queue.sqlite")
+JOB_STATUSES = ["queued", "running", "done", "failed", "cancelled"]
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 60 # Seconds before the first retry of a transient failure, doubled for every further attempt
+JOB_LEASE_SECONDS = 60 # A running job whose worker stopped renewing it for this long is queued again
+JOB_POLL_INTERVAL = 5 # Seconds an idle worker waits before looking for new jobs
+# Failures that may pass on a retry: a full disk or a flaky drive, and tool messages of GPU encoder
+# sessions or memory taken by other processes. Everything else fails the same way every time.
+TRANSIENT_ERRNOS = {errno.ENOSPC, errno.EIO, errno.EAGAIN, errno.EBUSY, errno.ENOMEM}
+TRANSIENT_TOOL_ERRORS = re.compile(r"OpenEncodeSessionEx failed|out of memory|Cannot allocate memory|No space left on device|"
+                                   r"Input/output error|Resource temporarily unavailable|Device or resource busy|"
+                                   r"MFX_ERR_DEVICE_BUSY|MFX_ERR_MEMORY_ALLOC|CUDA_ERROR_OUT_OF_MEMORY", re.IGNORECASE)
+
+# Artifacts up to this size are hashed in full; larger ones hash evenly spaced sample blocks
+CHECKSUM_FULL_LIMIT = 64 * 1024 * 1024
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+CHECKSUM_SAMPLE_BLOCKS = 16
+
+# Segmented libx265 encoding: the title is split at keyframes and the chunks are encoded in parallel
+DEFAULT_CPU_SEGMENTS = 1 # 1 = encode the whole title in one x265 process
+MIN_SEGMENT_FRAMES = 2000 # Don't split finer than this, x265 lookahead needs room to work
+
+# Quality auto-tuning: short samples spread over the title are encoded at candidate quality values
+# and a bisection over QUALITY_RANGE finds the value that meets the size target or VMAF floor
+AUTO_QUALITY_MODES = ["Off", "Size", "VMAF"]
+QUALITY_RANGE = (16, 40)
+TUNING_SAMPLES = 6
+TUNING_SAMPLE_SECONDS = 5
+TUNING_HW_WORKERS = 2 # Samples encoded at once on a GPU; CPU samples split the cores instead
+VMAF_SCORE = re.compile(r"VMAF score[:=]\s*([\d.]+)")
+
+# How often a running ffmpeg's progress is passed on; updates in between are coalesced
+PROGRESS_INTERVAL = 0.5
+PROCESS_POLL_INTERVAL = 0.05 # How often a traced tool is checked for having exited
+process_lock = threading.Lock() # Signalling and reaping of tool processes
+
+# Scratch space: intermediates go to scratch_folder (default: "temp" in the output folder), one
+# folder per job. A job is only admitted once its estimated peak fits on the scratch volume.
+ESTIMATED_ENCODE_RATIO = 0.6 # Encoded video size relative to the source, on the safe side
+ESTIMATED_VIDEO_SHARE = 0.85 # Video part of a source; the rest is audio, subtitles and attachments
+SCRATCH_HEADROOM_BYTES = 1024 ** 3 # Left free on the scratch volume for everything else
+
+# Per-file run reports and batch summaries, kept in the output folder
+REPORTS_FOLDER_NAME = "redovi_reports"
+SCAN_SKIP_FOLDERS = ("temp", REPORTS_FOLDER_NAME) # Never scanned for sources
+
+# Frames read by the pre-flight DoVi probe (a few GOPs of a typical UHD source)
+DOVI_PROBE_FRAMES = 120
+
+# Every option the GUI stores in config.json, with its default
+DEFAULT_SETTINGS = {
+    "quality": 23,
+    "encode_profile": "Standard", # A name from ENCODE_PROFILES, or "Auto"
+    "auto_quality": "Off", # "Size" or "VMAF": pick the quality from sampled encodes instead
+    "target_size_gb": 20, # Video size of the whole title for "Size"
+    "target_vmaf": 93, # Lowest mean VMAF of the samples for "VMAF"
+    "audio_channels": "No",
+    "encoding_mode": "CUDA",
+    "audio_bitrate": "640k",
+    "keep_original_audio": "Keep",
+    "encoding_quality": "slow",
+    "pipeline_mode": "Temp Files",
+    "failed_temp": "Keep Temp",
+    "scratch_folder": "", # Empty = "temp" inside the output folder
+    "cpu_segments": DEFAULT_CPU_SEGMENTS,
+    "parallel_files": DEFAULT_PARALLEL_FILES,
+    "slot_limits": DEFAULT_SLOT_LIMITS,
+    "output_cache": "Reuse",
+    "output_cache_limit_gb": 0 # Outputs the cache index may refer to in total, 0 = no limit
+}
+
+# Presets offered for each encoding mode
+QUALITY_PRESETS = {
+    "CUDA": ["slow", "medium", "fast", "hp", "hq"],
+    "QSV": ["slow", "medium", "fast", "faster", "veryfast"],
+    "CPU": ["ultrafast", "faster", "fast", "medium", "slow", "veryslow", "slower", "placebo"]
+}
+
+# Load settings from the configuration file
+def load_settings(path=None):
+    path = path or config_file
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return {}
+
+# Save settings to the configuration file
+def save_settings(settings, path=None):
+    with open(path or config_file, "w") as f:
+        json.dump(settings, f)
+
+@dataclass
+class StreamInfo:
+    index: int
+    codec_type: str
+    codec_name: str
+    language: str = "und"
+    title: str = ""
+    channels: int = 0
+    default: bool = False
+    forced: bool = False
+
+@dataclass
+class MediaInfo:
+    path: str
+    size: int
+    mtime_ns: int
+    duration: float = 0.0
+    start_time: float = 0.0 # Container start; input -ss positions are relative to it
+    width: int = 0
+    height: int = 0
+    frame_rate: float = 0.0
+    frame_count: int = 0
+    pix_fmt: str = ""
+    color_primaries: str = ""
+    color_transfer: str = ""
+    color_space: str = ""
+    mastering_display: dict = None # ffprobe "Mastering display metadata" side data
+    content_light_level: dict = None # ffprobe "Content light level metadata" side data
+    dv_profile: int = None # From the DOVI configuration record, if the container has one
+    chapter_count: int = 0
+    streams: list = field(default_factory=list)
+
+    @property
+    def video_streams(self):
+        return [s for s in self.streams if s.codec_type == "video"]
+
+    @property
+    def audio_streams(self):
+        return [s for s in self.streams if s.codec_type == "audio"]
+
+    @property
+    def subtitle_streams(self):
+        return [s for s in self.streams if s.codec_type == "subtitle"]
+
+    # The track players pick by default; ffmpeg's own choice when no track is flagged
+    @property
+    def default_audio_stream(self):
+        audio = self.audio_streams
+        flagged = [s for s in audio if s.default]
+        return (flagged or audio or [None])[0]
+
+    @staticmethod
+    def from_dict(data):
+        data = dict(data)
+        data['streams'] = [StreamInfo(**s) for s in data.get('streams', [])]
+        return MediaInfo(**data)
+
+def parse_rate(rate):
+    try:
+        numerator, denominator = rate.split('/')
+        return float(numerator) / float(denominator) if float(denominator) else 0.0
+    except (AttributeError, ValueError):
+        return 0.0
+
+def parse_ffprobe_output(input_file, stat, probe):
+    info = MediaInfo(path=input_file, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+    info.duration = float(probe.get('format', {}).get('duration', 0) or 0)
+    info.start_time = float(probe.get('format', {}).get('start_time', 0) or 0)
+    info.chapter_count = len(probe.get('chapters', []))
+    for stream in probe.get('streams', []):
+        tags = stream.get('tags', {})
+        disposition = stream.get('disposition', {})
+        info.streams.append(StreamInfo(
+            index=stream['index'],
+            codec_type=stream.get('codec_type', ""),
+            codec_name=stream.get('codec_name', ""),
+            language=tags.get('language', "und"),
+            title=tags.get('title', ""),
+            channels=int(stream.get('channels', 0)),
+            default=bool(disposition.get('default')),
+            forced=bool(disposition.get('forced'))
+        ))
+        if stream.get('codec_type') != "video" or info.width:
+            continue
+        # HDR and DoVi details come from the first video stream
+        info.width = int(stream.get('width', 0))
+        info.height = int(stream.get('height', 0))
+        info.frame_rate = parse_rate(stream.get('avg_frame_rate')) or parse_rate(stream.get('r_frame_rate'))
+        info.pix_fmt = stream.get('pix_fmt', "")
+        info.color_primaries = stream.get('color_primaries', "")
+        info.color_transfer = stream.get('color_transfer', "")
+        info.color_space = stream.get('color_space', "")
+        # mp4 reports nb_frames, mkvmerge-written files carry a NUMBER_OF_FRAMES statistics tag
+        frame_count = stream.get('nb_frames') or tags.get('NUMBER_OF_FRAMES') or tags.get('NUMBER_OF_FRAMES-eng') or 0
+        info.frame_count = int(frame_count)
+        if not info.duration:
+            info.duration = float(stream.get('duration', 0) or 0)
+        for side_data in stream.get('side_data_list', []):
+            side_data_type = side_data.get('side_data_type', "")
+            if side_data_type == "DOVI configuration record":
+                info.dv_profile = side_data.get('dv_profile')
+            elif side_data_type == "Mastering display metadata":
+                info.mastering_display = {k: v for k, v in side_data.items() if k != 'side_data_type'}
+            elif side_data_type == "Content light level metadata":
+                info.content_light_level = {k: v for k, v in side_data.items() if k != 'side_data_type'}
+    if not info.frame_count and info.duration and info.frame_rate:
+        info.frame_count = round(info.duration * info.frame_rate)
+    return info
+
+probe_cache = None
+probe_cache_lock = threading.Lock()
+batch_state_lock = threading.Lock()
+
+def load_probe_cache():
+    global probe_cache
+    if probe_cache is None:
+        try:
+            with open(probe_cache_file, "r") as f:
+                probe_cache = json.load(f)
+        except (OSError, ValueError):
+            probe_cache = {}
+    return probe_cache
+
+def save_probe_cache():
+    # Oldest entries are dropped first; dicts keep insertion order and hits are re-inserted
+    while len(probe_cache) > PROBE_CACHE_MAX_ENTRIES:
+        del probe_cache[next(iter(probe_cache))]
+    temp_file = probe_cache_file + ".tmp"
+    try:
+        with open(temp_file, "w") as f:
+            json.dump(probe_cache, f)
+        os.replace(temp_file, probe_cache_file)
+    except OSError:
+        pass # The cache is only an optimisation
+
+# Probe a source once and return a MediaInfo that every stage shares.
+# Results are reused as long as the file's size and mtime haven't changed.
+def probe_media(input_file):
+    input_file = os.path.abspath(input_file)
+    stat = os.stat(input_file)
+    with probe_cache_lock:
+        cache = load_probe_cache()
+        cached = cache.pop(input_file, None)
+        # Entries written before a MediaInfo field existed are probed again
+        if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns and set(cached) >= {f.name for f in fields(MediaInfo)}:
+            cache[input_file] = cached # Re-insert as most recently used
+            return MediaInfo.from_dict(cached)
+
+    command = [
+        ffprobe_path,
+        '-v', 'error',
+        '-print_format', 'json',
+        '-show_format',
+        '-show_streams',
+        '-show_chapters',
+        input_file
+    ]
+    result = run_tool(command, "probe_media", capture_output=True, check=True)
+    info = parse_ffprobe_output(input_file, stat, json.loads(result.stdout))
+
+    with probe_cache_lock:
+        cache = load_probe_cache()
+        cache[input_file] = asdict(info)
+        save_probe_cache()
+    return info
+
+capabilities = None
+capabilities_lock = threading.Lock()
+
+# Identifies this host's ffmpeg build without running it
+def ffmpeg_build_key():
+    stat = os.stat(ffmpeg_path)
+    return f"{platform.node()}|{os.path.abspath(ffmpeg_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+# First column of "ffmpeg -hwaccels" / "ffmpeg -encoders"
+def list_ffmpeg_names(option):
+    result = subprocess.run([ffmpeg_path, '-hide_banner', option], capture_output=True, text=True, creationflags=NO_WINDOW)
+    lines = result.stdout.splitlines()
+    if option == '-encoders':
+        # The encoder table starts after the " ------" line that ends the flag legend
+        start = next((i + 1 for i, line in enumerate(lines) if line.strip().startswith('---')), len(lines))
+        return [line.split()[1] for line in lines[start:] if len(line.split()) > 1]
+    return [line.strip() for line in lines[1:] if line.strip()] # Skip "Hardware acceleration methods:"
+
+# Number of short test encodes that succeed when `sessions` of them run at the same time
+def test_encoder(encoder, sessions=1):
+    command = [
+        ffmpeg_path, '-hide_banner', '-v', 'error',
+        '-re', # Realtime input keeps all sessions open at once
+        '-f', 'lavfi', '-i', 'color=black:s=640x360:r=25:d=1',
+        '-pix_fmt', 'nv12' if encoder == 'hevc_qsv' else 'yuv420p',
+        '-c:v', encoder,
+        '-f', 'null', '-'
+    ]
+    processes = [subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, creationflags=NO_WINDOW) for _ in range(sessions)]
+    return sum(1 for process in processes if process.wait() == 0)
+
+# Whether each mode's encoder works and how many NVENC sessions the driver allows depend on what
+# else holds the GPU at the time, so they are tested once per process and never saved
+PROCESS_CAPABILITIES = ("modes", "nvenc_sessions")
+
+def save_capabilities(detected):
+    cache = read_json_file(capabilities_file, {})
+    cache[detected["key"]] = {name: value for name, value in detected.items() if name not in PROCESS_CAPABILITIES}
+    write_json_file(capabilities_file, cache)
+
+# Available hwaccels and encoders, working encoding modes and the NVENC session limit. The hwaccel
+# and encoder lists are probed once per host and ffmpeg build and kept in hw_capabilities.json;
+# refresh=True probes them again (e.g. after a driver update).
+def detect_capabilities(refresh=False):
+    global capabilities
+    with capabilities_lock:
+        try:
+            key = ffmpeg_build_key()
+        except OSError:
+            key = None # No ffmpeg at all, every mode fails the same way
+        if capabilities is not None and capabilities["key"] == key and not refresh:
+            return capabilities
+        detected = None if refresh else read_json_file(capabilities_file, {}).get(key)
+        if detected is None:
+            hwaccels = list_ffmpeg_names('-hwaccels') if key else []
+            detected = {
+                "key": key,
+                "detected": time.time(),
+                "hwaccels": hwaccels,
+                "encoders": [name for name in (list_ffmpeg_names('-encoders') if key else []) if "hevc" in name or "265" in name],
+                "hw_decode": {mode: MODE_HWACCELS[mode] in hwaccels for mode in MODE_HWACCELS}
+            }
+            if key:
+                save_capabilities(detected)
+
+        # The encoders are tested side by side, each mode uses a different device
+        with ThreadPoolExecutor(max_workers=len(MODE_ENCODERS)) as pool:
+            tests = {mode: pool.submit(test_encoder, encoder) for mode, encoder in MODE_ENCODERS.items() if encoder in detected["encoders"]}
+        modes = {mode: mode in tests and tests[mode].result() == 1 for mode in MODE_ENCODERS}
+        capabilities = dict(detected, modes=modes,
+                            nvenc_sessions=test_encoder(MODE_ENCODERS["CUDA"], NVENC_PROBE_SESSIONS) if modes["CUDA"] else 0)
+        return capabilities
+
+# Adds {mode: {profile: fps}} from benchmark_profiles to this host's capabilities
+def record_profile_fps(results):
+    detected = detect_capabilities()
+    with capabilities_lock:
+        profile_fps = detected.setdefault("profile_fps", {})
+        for mode, fps in results.items():
+            profile_fps.setdefault(mode, {}).update(fps)
+        if detected["key"]:
+            save_capabilities(detected)
+
+# Profiles that give a mode a command of its own. Without GPU decoding Standard decodes in software
+# too, so Software Decode would only repeat it.
+def profiles_for_mode(encoding_mode, hw_decode=True):
+    return [name for name, modes in ENCODE_PROFILES.items()
+            if encoding_mode in modes and (hw_decode or modes[encoding_mode].get("decode") != "software")]
+
+# The profile an encode uses: "Auto" is the fastest benchmarked one for the mode on this host, and
+# a profile that doesn't cover the mode means Standard
+def select_encode_profile(name, encoding_mode):
+    detected = detect_capabilities()
+    offered = profiles_for_mode(encoding_mode, detected["hw_decode"].get(encoding_mode, False))
+    if name != "Auto":
+        return name if name in offered else "Standard"
+    fps = detected.get("profile_fps", {}).get(encoding_mode, {})
+    candidates = {profile: value for profile, value in fps.items() if profile in AUTO_PROFILES and profile in offered}
+    return max(candidates, key=candidates.get) if candidates else "Standard"
+
+# Called after an encode in mode failed; that file falls back to the next mode either way. The mode
+# is only dropped, for the rest of this process, when a test encode fails as well, so a bad source
+# can't take the GPU away from every later file.
+def recheck_encoder_mode(mode):
+    if mode in MODE_ENCODERS and test_encoder(MODE_ENCODERS[mode]) == 1:
+        return True
+    with capabilities_lock:
+        if capabilities is not None:
+            capabilities["modes"][mode] = False
+    return False
+
+# The requested mode followed by its fallbacks, limited to the modes that work on this host
+def encoding_mode_chain(requested):
+    modes = detect_capabilities()["modes"]
+    chain = ENCODER_FALLBACK[ENCODER_FALLBACK.index(requested):] if requested in ENCODER_FALLBACK else ["CPU"]
+    return [mode for mode in chain if modes.get(mode)] or [requested]
+
+# Slot limits with the NVENC slots capped to the sessions the driver actually allows
+def hardware_slot_limits(slot_limits):
+    limits = dict(DEFAULT_SLOT_LIMITS)
+    limits.update(slot_limits)
+    nvenc_sessions = detect_capabilities()["nvenc_sessions"]
+    if nvenc_sessions:
+        limits["nvenc"] = min(int(limits["nvenc"]), nvenc_sessions)
+    return limits
+
+# Resource usage of the tool processes, collected per stage. A stage makes its StageTrace the current
+# one for its thread, and every process started through run_tool or run_ffmpeg_with_progress on that
+# thread is added to it.
+trace_state = threading.local()
+
+class StageTrace:
+    def __init__(self, stage):
+        self.stage = stage
+        self.processes = []
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        with self.lock:
+            self.processes.append(record)
+
+    # Totals of the stage; cpu_utilization above 1 means several cores were busy
+    def summary(self, wall_seconds):
+        summary = {"wall_seconds": round(wall_seconds, 3), "processes": self.processes}
+        summary.update(sum_process_usage(self.processes))
+        if summary.get("cpu_seconds") is not None and wall_seconds:
+            summary["cpu_utilization"] = round(summary["cpu_seconds"] / wall_seconds, 2)
+        if summary.get("frames") and wall_seconds:
+            summary["fps"] = round(summary["frames"] / wall_seconds, 2)
+        return summary
+
+USAGE_TOTALS = ("cpu_user_seconds", "cpu_system_seconds", "read_bytes", "write_bytes", "disk_read_bytes", "disk_write_bytes", "frames")
+
+# Sums (and the highest peak RSS) of process records or stage summaries
+def sum_process_usage(records):
+    totals = {}
+    for key in USAGE_TOTALS:
+        values = [record[key] for record in records if record.get(key) is not None]
+        if values:
+            totals[key] = round(sum(values), 3)
+    if "cpu_user_seconds" in totals:
+        totals["cpu_seconds"] = round(totals["cpu_user_seconds"] + totals.get("cpu_system_seconds", 0), 3)
+    peaks = [record["peak_rss_bytes"] for record in records if record.get("peak_rss_bytes") is not None]
+    if peaks:
+        totals["peak_rss_bytes"] = max(peaks)
+    return totals
+
+def current_trace():
+    return getattr(trace_state, "trace", None)
+
+@contextmanager
+def tracing(trace):
+    previous = current_trace()
+    trace_state.trace = trace
+    try:
+        yield trace
+    finally:
+        trace_state.trace = previous
+
+# Bytes a process moved through read/write calls (including pipes and the page cache) and
+# to/from storage. Linux only.
+def read_process_io(pid):
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+    except (OSError, ValueError):
+        return None
+    return {
+        "read_bytes": int(fields["rchar"]),
+        "write_bytes": int(fields["wchar"]),
+        "disk_read_bytes": int(fields["read_bytes"]),
+        "disk_write_bytes": int(fields["write_bytes"])
+    }
+
+# Waits for the process and returns (rusage, io), either of which is None where the platform
+# can't tell. The child is first waited for without being reaped, so its I/O counters are still
+# readable, then reaped with wait4 for its CPU time and peak RSS. poll is called while waiting.
+def wait_for_process(process, poll=None):
+    try:
+        if hasattr(os, "waitid"):
+            while not os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT | os.WNOHANG):
+                if poll:
+                    poll()
+                time.sleep(PROCESS_POLL_INTERVAL)
+            io = read_process_io(process.pid)
+            with process_lock: # The pid must not be signalled once it is reaped and free for reuse
+                _, status, usage = os.wait4(process.pid, 0)
+                process.returncode = os.waitstatus_to_exitcode(status)
+            return usage, io
+    except ChildProcessError:
+        pass # Already reaped through the Popen object, only the exit code is left
+    while True:
+        try:
+            process.wait(timeout=PROGRESS_INTERVAL)
+            return None, None
+        except subprocess.TimeoutExpired:
+            if poll:
+                poll()
+
+# Starts a tool under the current cancel token. On POSIX it gets its own process group, so a
+# cancel reaches anything the tool spawns itself and a terminal's Ctrl+C only reaches ReDoVi.
+def start_process(command, **kwargs):
+    token = current_cancel_token()
+    token.raise_if_cancelled()
+    if os.name == "posix":
+        kwargs["start_new_session"] = True
+    else:
+        kwargs["creationflags"] = NO_WINDOW | getattr(subprocess, "CREATE_NEW_PROCESS_GROUP", 0)
+    process = subprocess.Popen(command, **kwargs)
+    process.own_group = os.name == "posix"
+    token.register(process)
+    return process
+
+# Popen.terminate polls the child first, which would reap it before wait_for_process gets its usage
+def signal_process(process, kill=False):
+    with process_lock:
+        if process.returncode is not None:
+            return
+        try:
+            if getattr(process, "own_group", False):
+                os.killpg(process.pid, signal.SIGKILL if kill else signal.SIGTERM)
+            elif hasattr(os, "waitid"):
+                os.kill(process.pid, signal.SIGKILL if kill else signal.SIGTERM)
+            else:
+                process.kill() if kill else process.terminate()
+        except OSError:
+            pass # Already gone
+
+# SIGTERM now, SIGKILL if the tool is still running after timeout; returns without waiting
+def terminate_process(process, timeout=TERMINATE_TIMEOUT):
+    signal_process(process)
+    timer = threading.Timer(timeout, signal_process, (process, True))
+    timer.daemon = True
+    timer.start()
+
+def record_process(function, command, started, returncode, usage, io, stats=None):
+    trace = current_trace()
+    if trace is None:
+        return
+    record = {
+        "function": function,
+        "tool": os.path.basename(command[0]),
+        "returncode": returncode,
+        "wall_seconds": round(time.monotonic() - started, 3)
+    }
+    if usage is not None:
+        record["cpu_user_seconds"] = round(usage.ru_utime, 3)
+        record["cpu_system_seconds"] = round(usage.ru_stime, 3)
+        record["peak_rss_bytes"] = usage.ru_maxrss * (1 if platform.system() == "Darwin" else 1024) # KB on Linux
+    if io is not None:
+        record.update(io)
+    if stats:
+        record.update(frames=stats["frame"], fps=stats["fps"], speed=stats["speed"])
+    trace.add(record)
+
+# subprocess.run for the tools, with the process's resource usage added to the current trace.
+# Raises Cancelled when the job was cancelled while the tool ran.
+def run_tool(command, function, capture_output=False, check=False):
+    started = time.monotonic()
+    output = {}
+    readers = []
+    if capture_output:
+        process = start_process(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        # Both pipes are drained so a chatty tool can't block on a full one
+        for name, stream in (("stdout", process.stdout), ("stderr", process.stderr)):
+            readers.append(threading.Thread(target=lambda name=name, stream=stream: output.update({name: stream.read()}), daemon=True))
+    else:
+        # The console output never reaches our own stdout, where the CLI writes its JSON lines; only its
+        # last lines are kept, for the error message. mkvmerge reports errors on stdout, so both go to one pipe.
+        process = start_process(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace")
+        keep_tail = lambda: output.update(stderr="\n".join(deque((line.rstrip() for line in process.stdout), maxlen=TOOL_OUTPUT_TAIL)))
+        readers.append(threading.Thread(target=keep_tail, daemon=True))
+    for reader in readers:
+        reader.start()
+    usage, io = wait_for_process(process)
+    for reader in readers:
+        reader.join()
+    record_process(function, command, started, process.returncode, usage, io)
+    current_cancel_token().raise_if_cancelled()
+    result = subprocess.CompletedProcess(command, process.returncode, output.get("stdout"), output.get("stderr"))
+    if check and result.returncode != 0:
+        raise ToolError(result.returncode, command, result.stdout, result.stderr)
+    return result
+
+# Stream copy of the video track as Annex-B HEVC; nothing is decoded, so no hwaccel is needed
+def extract_hevc_stream(input_file, hevc_file):
+    command = [
+        ffmpeg_path,
+        '-i', input_file,
+        '-map', '0:v:0',
+        '-c:v', 'copy',
+        '-bsf:v', 'hevc_mp4toannexb',
+        '-f', 'hevc',
+        '-y', hevc_file
+    ]
+    run_tool(command, "extract_hevc_stream", check=True)
+
+def extract_dovi_metadata(hevc_file, metadata_file):
+    # Use -m 4 for RPU extraction
+    command = [
+        dovi_tool_path,
+        '-m', '4',
+        'extract-rpu',
+        '-i', hevc_file,
+        '-o', metadata_file
+    ]
+    # Single pass: the "no RPU" check and the exit code both come from the same run
+    result = run_tool(command, "extract_dovi_metadata", capture_output=True)
+
+    # Check if RPU was found
+    if "Found no RPU" in result.stderr:
+        raise ValueError("No Dolby Vision metadata found in the source file")
+    if result.returncode != 0:
+        raise ToolError(result.returncode, command, output=result.stdout, stderr=result.stderr)
+
+def extract_dovi_metadata_streamed(input_file, metadata_file, max_frames=None):
+    # ffmpeg writes the Annex-B HEVC stream to stdout and dovi_tool reads it from stdin,
+    # so the full size _temp.hevc is never written
+    demux_command = [
+        ffmpeg_path,
+        '-i', input_file,
+        '-map', '0:v:0',
+        '-c:v', 'copy',
+        '-bsf:v', 'hevc_mp4toannexb'
+    ]
+    if max_frames:
+        demux_command += ['-frames:v', str(max_frames)]
+    demux_command += ['-f', 'hevc', '-']
+    extract_command = [
+        dovi_tool_path,
+        '-m', '4',
+        'extract-rpu',
+        '-',
+        '-o', metadata_file
+    ]
+    started = time.monotonic()
+    # Neither tool's console output reaches our own stdout. The last lines of ffmpeg's are kept for
+    # its error message; dovi_tool writes the RPU to a file, so all it prints comes through one pipe.
+    demux = start_process(demux_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    demux_output = {}
+    keep_tail = lambda: demux_output.update(stderr="\n".join(deque((line.decode(errors="replace").rstrip() for line in demux.stderr), maxlen=TOOL_OUTPUT_TAIL)))
+    reader = threading.Thread(target=keep_tail, daemon=True)
+    reader.start()
+    extract = start_process(extract_command, stdin=demux.stdout, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace")
+    demux.stdout.close() # Let ffmpeg get SIGPIPE if dovi_tool exits early
+    output = extract.stdout.read()
+    extract_usage = wait_for_process(extract)
+    demux_usage = wait_for_process(demux)
+    reader.join()
+    record_process("extract_dovi_metadata_streamed", extract_command, started, extract.returncode, *extract_usage)
+    record_process("extract_dovi_metadata_streamed", demux_command, started, demux.returncode, *demux_usage)
+    current_cancel_token().raise_if_cancelled()
+
+    # A failed demux is why dovi_tool found nothing; ffmpeg ended by SIGPIPE only means dovi_tool stopped reading
+    if demux.returncode not in (0, -getattr(signal, "SIGPIPE", 0)):
+        raise ToolError(demux.returncode, demux_command, stderr=demux_output.get("stderr"))
+    if "Found no RPU" in output:
+        raise ValueError("No Dolby Vision metadata found in the source file")
+    if extract.returncode != 0:
+        raise ToolError(extract.returncode, extract_command, stderr=output)
+
+# Quick DoVi check on the first few GOPs so non-DV files are rejected before the full demux.
+# Returns the profile of the probed RPU, None when the source has no DoVi metadata.
+def probe_dovi(input_file, probe_file):
+    try:
+        extract_dovi_metadata_streamed(input_file, probe_file, max_frames=DOVI_PROBE_FRAMES)
+        return read_rpu_profile(probe_file)
+    except RpuError:
+        raise
+    except ValueError:
+        return None
+    finally:
+        if os.path.exists(probe_file):
+            os.remove(probe_file)
+
+# A fallback mode keeps the preset if it has one of that name
+def preset_for_mode(encoding_mode, encoding_quality_preset):
+    return encoding_quality_preset if encoding_quality_preset in QUALITY_PRESETS.get(encoding_mode, []) else "medium"
+
+# Rate control of each encoder
+def encoder_args(encoding_mode, quality, encoding_quality_preset):
+    if encoding_mode == "CUDA":
+        return ['-c:v', 'hevc_nvenc', '-preset', encoding_quality_preset, '-tune', 'hq', '-rc', 'vbr', '-cq', str(quality), '-b:v', '0']
+    if encoding_mode == "QSV":
+        return ['-c:v', 'hevc_qsv', '-preset', encoding_quality_preset, '-global_quality', str(quality)] # Correct parameter for QSV
+    return ['-c:v', 'libx265', '-crf', str(quality), '-preset', encoding_quality_preset]
+
+# QSV needs its device set up before the inputs
+def encoder_device_args(encoding_mode):
+    return ['-init_hw_device', 'qsv=hw', '-filter_hw_device', 'hw'] if encoding_mode == "QSV" else []
+
+def parse_ratio(value):
+    return parse_rate(value) if "/" in str(value) else float(value or 0)
+
+# HDR10 static metadata of the source for x265, which doesn't take it from the decoded frames the
+# way recent ffmpeg builds pass it on to NVENC and QSV
+def x265_hdr10_params(media_info):
+    params = {}
+    display = media_info.mastering_display if media_info else None
+    if display and all(f"{color}_{axis}" in display for color in ("red", "green", "blue", "white_point") for axis in "xy"):
+        chroma = lambda color: f"({round(parse_ratio(display[color + '_x']) * 50000)},{round(parse_ratio(display[color + '_y']) * 50000)})"
+        luminance = lambda key: round(parse_ratio(display.get(key, 0)) * 10000)
+        params["master-display"] = (f"G{chroma('green')}B{chroma('blue')}R{chroma('red')}WP{chroma('white_point')}"
+                                    f"L({luminance('max_luminance')},{luminance('min_luminance')})")
+    light_level = media_info.content_light_level if media_info else None
+    if light_level:
+        params["max-cll"] = f"{light_level.get('max_content', 0)},{light_level.get('max_average', 0)}"
+    if params:
+        params.update({"hdr10": 1, "repeat-headers": 1})
+    return params
+
+# Encoder arguments of a profile's parameter set. Frames that stay in GPU memory keep their own
+# 10-bit format; frames in system memory are converted to the 10-bit format the encoder takes.
+def profile_args(encoding_mode, params, media_info=None, gpu_frames=False, pools=None):
+    args = []
+    if not gpu_frames:
+        args += ['-pix_fmt', 'yuv420p10le' if encoding_mode == "CPU" else 'p010le']
+    args += ['-profile:v', 'main10']
+    if encoding_mode == "CUDA":
+        if "lookahead" in params:
+            args += ['-rc-lookahead', str(params["lookahead"])]
+        if "bframes" in params:
+            args += ['-bf', str(params["bframes"])]
+        if params.get("b_ref_mode"):
+            args += ['-b_ref_mode', params["b_ref_mode"]]
+        if params.get("spatial_aq"):
+            args += ['-spatial-aq', '1']
+    elif encoding_mode == "QSV":
+        if "lookahead" in params:
+            args += ['-look_ahead_depth', str(params["lookahead"])]
+        if "bframes" in params:
+            args += ['-bf', str(params["bframes"])]
+    else:
+        x265 = {}
+        if pools:
+            x265["pools"] = pools
+        for key, name in (("frame_threads", "frame-threads"), ("lookahead_threads", "lookahead-threads"), ("lookahead", "rc-lookahead"), ("bframes", "bframes")):
+            if key in params:
+                x265[name] = params[key]
+        x265.update(x265_hdr10_params(media_info))
+        if x265:
+            args += ['-x265-params', ":".join(f"{key}={value}" for key, value in x265.items())]
+    # The source's color description, so players see the HDR10 base layer as such
+    if media_info is not None:
+        for option, value in (('-color_primaries', media_info.color_primaries), ('-color_trc', media_info.color_transfer), ('-colorspace', media_info.color_space)):
+            if value:
+                args += [option, value]
+    return args
+
+# The ffmpeg command of every video encode: the whole title, a segment or a sample (start_time and
+# frame_count, and pools to split the cores between parallel x265 processes). With hw_decode the
+# frames are decoded on the GPU and stay there for the encoder, unless the profile decodes in software.
+def build_encode_command(input_file, output_file, encoding_mode, quality, encoding_quality_preset, profile="Standard",
+                         media_info=None, hw_decode=False, start_time=None, frame_count=None, pools=None):
+    params = ENCODE_PROFILES.get(profile, {}).get(encoding_mode, {})
+    gpu_frames = hw_decode and encoding_mode in HW_DECODE_ARGS and params.get("decode") != "software"
+    cmd = [ffmpeg_path] + encoder_device_args(encoding_mode)
+    if gpu_frames:
+        cmd += HW_DECODE_ARGS[encoding_mode]
+    if start_time is not None:
+        cmd += ['-ss', f"{start_time:.6f}"]
+    cmd += ['-i', input_file]
+    if frame_count is not None:
+        cmd += ['-map', '0:v:0', '-frames:v', str(frame_count)]
+    cmd += encoder_args(encoding_mode, quality, encoding_quality_preset)
+    cmd += profile_args(encoding_mode, params, media_info, gpu_frames, pools)
+    cmd += ['-an', '-sn', '-dn', '-f', 'hevc', '-y', output_file]
+    return cmd
+
+# Writes the video only, as an Annex-B elementary stream ready for inject-rpu.
+# Without hw_decode the source is decoded in software and only the encode runs on the GPU.
+def reencode_video(input_file, media_info, output_file, quality, encoding_mode, encoding_quality_preset, progress_callback, hw_decode=True, profile="Standard"):
+    cmd = build_encode_command(input_file, output_file, encoding_mode, quality, encoding_quality_preset, profile, media_info, hw_decode)
+    return run_ffmpeg_with_progress(cmd, progress_callback, total_duration=media_info.duration, total_frames=media_info.frame_count, function="reencode_video")
+
+def parse_number(value):
+    try:
+        return float(str(value).rstrip('x'))
+    except ValueError:
+        return 0.0 # ffmpeg reports N/A until the first frame is out
+
+# One "-progress" block as percent plus the encode statistics shown to the user
+def parse_progress_block(block, total_duration, total_frames):
+    frame = int(parse_number(block.get('frame', 0)))
+    fps = parse_number(block.get('fps', 0))
+    speed = parse_number(block.get('speed', 0))
+    out_seconds = parse_number(block.get('out_time_us', 0)) / 1000000
+    if total_frames:
+        percent = frame / total_frames * 100
+    elif total_duration:
+        percent = out_seconds / total_duration * 100
+    else:
+        percent = 0.0
+    eta_seconds = None
+    if total_duration and speed > 0:
+        eta_seconds = max(0.0, (total_duration - out_seconds) / speed)
+    elif total_frames and fps > 0:
+        eta_seconds = max(0.0, (total_frames - frame) / fps)
+    stats = {
+        "frame": frame,
+        "fps": fps,
+        "speed": speed,
+        "bitrate_kbps": parse_number(block.get('bitrate', '0').replace('kbits/s', '')),
+        "eta_seconds": round(eta_seconds) if eta_seconds is not None else None
+    }
+    return min(100.0, percent), stats
+
+# Run ffmpeg with its machine-readable progress channel (-progress pipe:1) instead of scraping stderr.
+# A reader thread parses the key=value blocks and only keeps the newest one; this loop looks at it
+# every PROGRESS_INTERVAL, so bursts are coalesced and abort is seen without waiting on a read.
+# progress_callback gets (percent, stats); the final stats are returned.
+def run_ffmpeg_with_progress(cmd, progress_callback, total_duration=0, total_frames=0, function="ffmpeg"):
+    cmd = [cmd[0], '-nostats', '-progress', 'pipe:1'] + cmd[1:]
+    started = time.monotonic()
+    process = start_process(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    latest = {}
+    stderr_tail = deque(maxlen=20) # Kept for the error message if ffmpeg fails
+
+    def read_progress():
+        block = {}
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            block[key] = value
+            if key == 'progress': # Last key of every block
+                latest['block'] = block
+                block = {}
+
+    def read_stderr():
+        for line in process.stderr:
+            stderr_tail.append(line.rstrip())
+
+    readers = [threading.Thread(target=read_progress, daemon=True), threading.Thread(target=read_stderr, daemon=True)]
+    for reader in readers:
+        reader.start()
+
+    state = {"reported": None, "last_poll": 0.0}
+    def poll():
+        if time.monotonic() - state["last_poll"] < PROGRESS_INTERVAL:
+            return
+        state["last_poll"] = time.monotonic()
+        block = latest.get('block')
+        if block is not None and block is not state["reported"]:
+            state["reported"] = block
+            progress_callback(*parse_progress_block(block, total_duration, total_frames))
+
+    usage, io = wait_for_process(process, poll)
+    for reader in readers:
+        reader.join(timeout=5)
+    reported = state["reported"]
+    block = latest.get('block', {})
+    stats = parse_progress_block(block, total_duration, total_frames)[1]
+    record_process(function, cmd, started, process.returncode, usage, io, stats)
+
+    # A failed or cancelled encode must not be checkpointed as a finished stage
+    current_cancel_token().raise_if_cancelled()
+    if process.returncode != 0:
+        raise ToolError(process.returncode, cmd, stderr="\n".join(stderr_tail))
+    if block is not reported:
+        progress_callback(*parse_progress_block(block, total_duration, total_frames))
+    return stats
+
+# Presentation-order frame times of the first video stream and the indices of its keyframes.
+# Only packets are read (no decoding), and the frame count is exact, which the RPU alignment depends on.
+def probe_keyframes(input_file):
+    command = [
+        ffprobe_path,
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        input_file
+    ]
+    result = run_tool(command, "probe_keyframes", capture_output=True, check=True)
+    packets = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.strip().partition(',')
+        if pts_time in ("", "N/A"):
+            raise ValueError("Source has packets without timestamps, it can't be split into segments")
+        packets.append((float(pts_time), 'K' in flags))
+    packets.sort()
+    frame_times = [pts for pts, _ in packets]
+    keyframes = [index for index, (_, keyframe) in enumerate(packets) if keyframe]
+    return frame_times, keyframes
+
+# Split points (frame indices) at the keyframes closest to an even division of the title
+def plan_segments(frame_count, keyframes, segments):
+    segments = max(1, min(segments, frame_count // MIN_SEGMENT_FRAMES))
+    boundaries = [0]
+    for i in range(1, segments):
+        target = frame_count * i // segments
+        nearest = min(keyframes, key=lambda k: abs(k - target))
+        if nearest > boundaries[-1]:
+            boundaries.append(nearest)
+    boundaries.append(frame_count)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+# Encode one chunk to raw HEVC; returns the number of frames ffmpeg reports as written
+def encode_segment(input_file, start_time, frame_count, output_file, quality, encoding_quality_preset, threads, progress_callback, profile="Standard", media_info=None):
+    cmd = build_encode_command(input_file, output_file, "CPU", quality, encoding_quality_preset, profile, media_info,
+                               start_time=start_time, frame_count=frame_count, pools=threads)
+    stats = run_ffmpeg_with_progress(cmd, progress_callback, total_frames=frame_count, function="encode_segment")
+    return stats["frame"]
+
+# CPU encode split into keyframe-aligned chunks that run as parallel x265 processes.
+# The raw chunks are concatenated losslessly, so the output has exactly the source's frames in order
+# and the RPU extracted from the source still lines up frame for frame.
+def reencode_video_segmented(input_file, output_file, quality, encoding_quality_preset, segments, segment_folder, progress_callback, profile="Standard", media_info=None):
+    frame_times, keyframes = probe_keyframes(input_file)
+    frame_count = len(frame_times)
+    container_start = media_info.start_time if media_info else frame_times[0] if frame_times else 0
+    plan = plan_segments(frame_count, keyframes, segments)
+    threads = max(1, (os.cpu_count() or 1) // len(plan))
+    os.makedirs(segment_folder, exist_ok=True)
+
+    frames_done = [0] * len(plan)
+    segment_fps = [0.0] * len(plan)
+    def segment_progress(index, stats):
+        frames_done[index] = stats["frame"]
+        segment_fps[index] = stats["fps"]
+        done = sum(frames_done)
+        fps = sum(segment_fps)
+        progress_callback(done / frame_count * 100, {
+            "frame": done,
+            "fps": fps,
+            "eta_seconds": round((frame_count - done) / fps) if fps else None
+        })
+
+    trace = current_trace() # The chunks run on pool threads but belong to the calling stage
+    token = current_cancel_token()
+    def encode_chunk(index):
+        with tracing(trace), cancelling(token):
+            return encode_chunk_traced(index)
+
+    def encode_chunk_traced(index):
+        start, end = plan[index]
+        # Half a frame early: ffmpeg then seeks to the keyframe before and drops frames up to it,
+        # so rounding in pts_time can never cost the chunk its first frame. pts_time is absolute while
+        # -ss counts from the container start, which isn't 0 in e.g. many transport stream rips.
+        if start > 0:
+            start_time = frame_times[start] - (frame_times[start] - frame_times[start - 1]) / 2 - container_start
+        else:
+            start_time = 0
+        chunk_file = os.path.join(segment_folder, f"segment_{index:03d}.hevc")
+        written = encode_segment(input_file, start_time, end - start, chunk_file, quality, encoding_quality_preset, threads,
+                                 lambda percent, stats: segment_progress(index, stats), profile, media_info)
+        if written != end - start:
+            raise ValueError(f"Segment {index} has {written} frames instead of {end - start}, the RPU would be out of sync")
+        return chunk_file
+
+    with ThreadPoolExecutor(max_workers=len(plan)) as pool:
+        chunk_files = list(pool.map(encode_chunk, range(len(plan))))
+
+    # Annex-B streams that each start with parameter sets and an IDR can simply be appended
+    with open(output_file, "wb") as output:
+        for chunk_file in chunk_files:
+            with open(chunk_file, "rb") as chunk:
+                shutil.copyfileobj(chunk, output, 16 * 1024 * 1024)
+            os.remove(chunk_file)
+    shutil.rmtree(segment_folder, ignore_errors=True)
+    return frame_count
+
+# Start times of the tuning samples, evenly spread over the title without its first and last 5%
+# (studio logos, credits)
+def plan_tuning_samples(duration, count=TUNING_SAMPLES, length=TUNING_SAMPLE_SECONDS):
+    usable = duration * 0.9 - length
+    if usable <= 0:
+        return [0.0]
+    return [duration * 0.05 + usable * (i + 0.5) / count for i in range(count)]
+
+# Half a frame before the frame nearest to seconds, like the segment seeks: the sample encode and its
+# VMAF reference then start on the same frame however the position is rounded
+def frame_seek_time(seconds, frame_rate):
+    frame = round(seconds * frame_rate)
+    return (frame - 0.5) / frame_rate if frame > 0 else 0.0
+
+# One short sample; returns ffmpeg's final stats. Tuning samples are decoded in software so they
+# run on any host the encoder works on, profile benchmarks decode the way the real encode would.
+def encode_sample(input_file, start_time, frame_count, output_file, quality, encoding_mode, encoding_quality_preset, threads,
+                  profile="Standard", media_info=None, hw_decode=False):
+    cmd = build_encode_command(input_file, output_file, encoding_mode, quality, encoding_quality_preset, profile, media_info, hw_decode,
+                               start_time, frame_count, pools=threads if encoding_mode == "CPU" and threads else None)
+    return run_ffmpeg_with_progress(cmd, lambda percent, stats: None, total_frames=frame_count, function="encode_sample")
+
+# Mean VMAF of a sample against the same frames of the source; needs an ffmpeg built with libvmaf
+def measure_vmaf(input_file, start_time, frame_count, sample_file):
+    cmd = [
+        ffmpeg_path,
+        '-i', sample_file,
+        '-ss', f"{start_time:.6f}", # Same position and format as the sample's own seek
+        '-i', input_file,
+        '-frames:v', str(frame_count),
+        '-lavfi', '[0:v][1:v:0]libvmaf',
+        '-f', 'null', '-'
+    ]
+    result = run_tool(cmd, "measure_vmaf", capture_output=True)
+    match = VMAF_SCORE.search(result.stderr or "")
+    if result.returncode != 0 or not match:
+        raise ValueError("VMAF could not be measured, this needs an ffmpeg built with libvmaf")
+    return float(match.group(1))
+
+# Picks the quality value for the size target or VMAF floor of options["auto_quality"] from sampled
+# encodes instead of full ones. Every candidate encodes the same samples in parallel, and the
+# video size of the whole title is extrapolated from their bitrate. Higher values give smaller
+# files and lower scores, so a bisection needs about five candidates out of QUALITY_RANGE.
+# Returns the chosen value, whether it meets the target and the measurements of every candidate.
+def tune_quality(input_file, media_info, options, encoding_mode, encoding_quality_preset, sample_folder, progress_callback, profile="Standard"):
+    target = options["auto_quality"]
+    frame_rate = media_info.frame_rate or 24
+    frame_count = max(1, int(TUNING_SAMPLE_SECONDS * frame_rate))
+    starts = [frame_seek_time(start, frame_rate) for start in plan_tuning_samples(media_info.duration)]
+    workers = len(starts) if encoding_mode == "CPU" else min(len(starts), TUNING_HW_WORKERS)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    os.makedirs(sample_folder, exist_ok=True)
+    trace = current_trace() # The samples run on pool threads but belong to the calling stage
+    token = current_cancel_token()
+    measured = {}
+
+    def measure_sample(quality, index):
+        with tracing(trace), cancelling(token):
+            sample_file = os.path.join(sample_folder, f"q{quality}_{index:02d}.hevc")
+            encode_sample(input_file, starts[index], frame_count, sample_file, quality, encoding_mode, encoding_quality_preset, threads, profile, media_info)
+            vmaf = measure_vmaf(input_file, starts[index], frame_count, sample_file) if target == "VMAF" else None
+            size = os.path.getsize(sample_file)
+            os.remove(sample_file)
+            return size, vmaf
+
+    def measure(quality):
+        if quality not in measured:
+            progress_callback(f"Analyzing quality {quality}...")
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                samples = list(pool.map(lambda index: measure_sample(quality, index), range(len(starts))))
+            bitrate = sum(size for size, _ in samples) * 8 / (len(samples) * frame_count / frame_rate)
+            measured[quality] = {
+                "quality": quality,
+                "bitrate_kbps": round(bitrate / 1000),
+                "predicted_bytes": int(bitrate / 8 * media_info.duration)
+            }
+            if target == "VMAF":
+                measured[quality]["vmaf"] = round(sum(vmaf for _, vmaf in samples) / len(samples), 2)
+        return measured[quality]
+
+    def meets(quality):
+        result = measure(quality)
+        if target == "Size":
+            return result["predicted_bytes"] <= float(options["target_size_gb"]) * 1024 ** 3
+        return result["vmaf"] >= float(options["target_vmaf"])
+
+    # Size: the lowest value that fits. VMAF: the highest value that still reaches the floor.
+    low, high = QUALITY_RANGE
+    while low < high:
+        if target == "Size":
+            middle = (low + high) // 2
+            if meets(middle):
+                high = middle
+            else:
+                low = middle + 1
+        else:
+            middle = (low + high + 1) // 2
+            if meets(middle):
+                low = middle
+            else:
+                high = middle - 1
+    # The bisection never measures the end of the range when no value in it meets the target
+    result = dict(measure(low), target=target, met=meets(low), encoding_mode=encoding_mode,
+                  candidates=[measured[quality] for quality in sorted(measured)])
+    shutil.rmtree(sample_folder, ignore_errors=True)
+    return result
+
+# Analysis only: the quality the auto-tuning would pick for a source, without encoding it
+def analyze_quality(input_file, options=None, on_event=None):
+    options = resolve_options(options)
+    if options["auto_quality"] == "Off":
+        raise ValueError("Set auto_quality to Size or VMAF to analyze a source")
+    media_info = probe_media(input_file)
+    mode = encoding_mode_chain(options["encoding_mode"])[0]
+    sample_folder = tempfile.mkdtemp(prefix="redovi_samples_", dir=options["scratch_folder"] or None)
+    try:
+        tuning = tune_quality(input_file, media_info, options, mode, preset_for_mode(mode, options["encoding_quality"]), sample_folder,
+                              lambda text: emit(on_event, "progress", file=input_file, percent=0, message=text),
+                              select_encode_profile(options["encode_profile"], mode))
+    finally:
+        shutil.rmtree(sample_folder, ignore_errors=True)
+    emit(on_event, "quality_tuned", file=input_file, **tuning)
+    return tuning
+
+# Encodes the same sample with every profile each mode this host can run offers and stores the fps
+# with the host's capabilities, where "Auto" picks from. Returns {mode: {profile: fps}}.
+def benchmark_profiles(input_file, options=None, on_event=None, modes=None, profiles=None):
+    options = resolve_options(options)
+    detected = detect_capabilities()
+    modes = modes or [mode for mode in ENCODER_FALLBACK if detected["modes"].get(mode)]
+    media_info = probe_media(input_file)
+    frame_count = max(1, int(PROFILE_BENCHMARK_SECONDS * (media_info.frame_rate or 24)))
+    start_time = plan_tuning_samples(media_info.duration, 1, PROFILE_BENCHMARK_SECONDS)[0]
+    sample_folder = tempfile.mkdtemp(prefix="redovi_profiles_", dir=options["scratch_folder"] or None)
+    results = {}
+    try:
+        for mode in modes:
+            hw_decode = detected["hw_decode"].get(mode, False)
+            mode_profiles = [profile for profile in profiles_for_mode(mode, hw_decode) if not profiles or profile in profiles]
+            for profile in mode_profiles:
+                emit(on_event, "progress", file=input_file, percent=len(results.get(mode, {})) / len(mode_profiles) * 100,
+                     message=f"Benchmarking {profile} with {mode}...")
+                started = time.monotonic()
+                encode_sample(input_file, start_time, frame_count, os.path.join(sample_folder, "sample.hevc"), options["quality"], mode,
+                              preset_for_mode(mode, options["encoding_quality"]), None, profile, media_info, hw_decode)
+                fps = round(frame_count / (time.monotonic() - started), 2)
+                results.setdefault(mode, {})[profile] = fps
+                emit(on_event, "profile_benchmarked", file=input_file, mode=mode, profile=profile, fps=fps)
+    finally:
+        shutil.rmtree(sample_folder, ignore_errors=True)
+    record_profile_fps(results)
+    return results
+
+# Channel layouts of the audio setting; the transcoded tracks never have more than their source
+AUDIO_CHANNELS = {"2.0 Stereo": 2, "5.1 Surround": 6, "7.1 Surround": 8}
+
+# Output tracks of the side track file, in order: (stream, channels to transcode to or None to copy,
+# default flag or None to keep the source's). A track that needs transcoding is followed by its
+# original when original audio is kept; tracks that already are AAC within the channel limit and
+# subtitles and attachments are copied as they are.
+def plan_side_tracks(media_info, channels, keep_original_audio):
+    target = AUDIO_CHANNELS.get(channels)
+    keep = keep_original_audio == "Keep"
+    tracks = []
+    for stream in media_info.audio_streams:
+        if target and not (stream.codec_name == "aac" and 0 < stream.channels <= target):
+            tracks.append((stream, min(target, stream.channels or target), None))
+            if keep:
+                tracks.append((stream, None, False)) # The transcoded track is the default one
+        elif target or keep:
+            tracks.append((stream, None, None))
+    for stream in media_info.streams:
+        if stream.codec_type in ("subtitle", "attachment"):
+            tracks.append((stream, None, None))
+    return tracks
+
+# Writes every non-video track the output gets into one Matroska file, in a single read of the
+# source: audio that needs it is transcoded (ffmpeg runs one encoder per track), everything else is
+# stream-copied with its language, title and flags, and the chapters come along. Returns None when
+# the output has no such tracks.
+def extract_side_tracks(input_file, media_info, output_file, channels, bitrate, keep_original_audio):
+    tracks = plan_side_tracks(media_info, channels, keep_original_audio)
+    if not tracks:
+        return None
+    command = [ffmpeg_path, '-i', input_file]
+    for stream, _, _ in tracks:
+        command += ['-map', f'0:{stream.index}']
+    command += ['-c', 'copy']
+    for n, (stream, output_channels, default) in enumerate(tracks):
+        if output_channels:
+            # The source title (e.g. "TrueHD Atmos 7.1") would be wrong on the AAC track
+            command += [f'-c:{n}', 'aac', f'-b:{n}', bitrate, f'-ac:{n}', str(output_channels), f'-metadata:s:{n}', 'title=']
+        elif stream.codec_name == "mov_text":
+            command += [f'-c:{n}', 'srt'] # MP4 text subtitles can't be stored in Matroska as they are
+        if default is not None: # Only the default flag changes; forced, comment and the rest stay
+            command += [f'-disposition:{n}', '+default' if default else '-default']
+    command += ['-f', 'matroska', '-y', output_file]
+    run_tool(command, "extract_side_tracks", check=True)
+    return output_file
+
+def inject_dovi_metadata(video_file, metadata_file, output_file):
+    command = [
+        dovi_tool_path,
+        '-m', '4',
+        'inject-rpu',
+        '-i', video_file,
+        '--rpu-in', metadata_file,
+        '-o', output_file
+    ]
+    run_tool(command, "inject_dovi_metadata", check=True)
+
+# One mkvmerge pass over the encoded video and the side track file; the source is not read again.
+# Without a side track file the chapters are taken from the source with all of its tracks disabled.
+def remux_video(video_file, side_track_file, original_file, media_info, output_file):
+    command = [mkvmerge_path, '-o', output_file, video_file]
+    if side_track_file:
+        command += ['--no-track-tags', '--no-global-tags', side_track_file]
+    elif media_info.chapter_count:
+        command += ['--no-video', '--no-audio', '--no-subtitles', '--no-attachments', '--no-track-tags', '--no-global-tags', original_file]
+    run_tool(command, "remux_video", check=True)
+
+# Bits per second of a bitrate as ffmpeg reads it: a number with an optional SI prefix ("i" after it
+# makes it binary) and "B" for bytes, e.g. "640k", "1.5M" or "640000"
+BITRATE_PATTERN = re.compile(r"\s*(\d+(?:\.\d*)?|\.\d+)(?:([kKMG])(i)?)?(B)?\s*")
+BITRATE_PREFIXES = {"k": 1, "K": 1, "M": 2, "G": 3}
+
+def parse_bitrate(value):
+    match = BITRATE_PATTERN.fullmatch(str(value))
+    if not match:
+        raise ValueError(f"Invalid audio bitrate {value!r}, expected e.g. 640k, 1.5M or 640000")
+    number, prefix, binary, in_bytes = match.groups()
+    return float(number) * (1024 if binary else 1000) ** BITRATE_PREFIXES.get(prefix, 0) * (8 if in_bytes else 1)
+
+# Peak scratch usage of a job: nothing is deleted before cleanup, so every intermediate adds up.
+# The remuxed output is written to scratch too and only moved to the destination at the end.
+def estimate_scratch_bytes(media_info, options):
+    encoded = media_info.size * ESTIMATED_ENCODE_RATIO
+    audio_streams = len(media_info.audio_streams) if options["audio_channels"] != "No" else 0
+    audio = parse_bitrate(options["audio_bitrate"]) / 8 * media_info.duration * audio_streams
+    if options["keep_original_audio"] == "Keep":
+        audio += media_info.size * (1 - ESTIMATED_VIDEO_SHARE) # Copied audio, subtitles and attachments
+    needed = 3 * encoded + 2 * audio # Encoded stream, with RPU injected, remuxed; side tracks, remuxed
+    if options["pipeline_mode"] != "Streamed":
+        needed += media_info.size # Demuxed source stream
+    if options["encoding_mode"] == "CPU" and int(options["cpu_segments"]) > 1:
+        needed += encoded # Segments and their concatenation exist side by side
+    return int(needed)
+
+# Per-job temp folder: unique for every source and output folder, so jobs sharing a scratch folder
+# never meet, and stable across runs so an interrupted job resumes
+def job_temp_folder(scratch_root, input_file, output_folder):
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+    job_key = os.path.abspath(input_file) + "\0" + os.path.abspath(output_folder)
+    source_id = hashlib.blake2b(job_key.encode(), digest_size=4).hexdigest()
+    return os.path.join(scratch_root, f"{base_name}_{source_id}")
+
+# Rename when source and destination share a volume; otherwise copy next to the destination first,
+# so a half-copied file never appears under the final name
+def move_to_destination(source, destination):
+    try:
+        os.replace(source, destination)
+    except OSError:
+        partial = destination + ".part"
+        shutil.copyfile(source, partial)
+        os.replace(partial, destination)
+        os.remove(source)
+
+def folder_size(folder):
+    total = 0
+    for dirpath, _, filenames in os.walk(folder):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass # File removed between listing and stat
+    return total
+
+def format_size(num_bytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+# Short "45.2 fps, 1.90x, ETA 0:42:10" summary of the encoder stats in a progress event
+def format_progress_stats(event):
+    parts = []
+    if event.get("fps"):
+        parts.append(f"{event['fps']:.1f} fps")
+    if event.get("speed"):
+        parts.append(f"{event['speed']:.2f}x")
+    if event.get("eta_seconds") is not None:
+        eta = int(event["eta_seconds"])
+        parts.append(f"ETA {eta // 3600}:{eta % 3600 // 60:02d}:{eta % 60:02d}")
+    return ", ".join(parts)
+
+# Append one line per processed file so the pipeline modes can be compared
+def record_pipeline_stats(stats):
+    try:
+        with open(stats_file, "a") as f:
+            f.write(json.dumps(stats) + "\n")
+    except OSError:
+        pass # Stats are informational only
+
+# Content checksum of an artifact. Multi-GB streams are sampled (size plus evenly spaced blocks)
+# so validating a checkpoint costs a few MB of reads instead of a full pass.
+def file_checksum(path):
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        if size <= CHECKSUM_FULL_LIMIT:
+            for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b""):
+                digest.update(block)
+        else:
+            step = (size - CHECKSUM_BLOCK_SIZE) // (CHECKSUM_SAMPLE_BLOCKS - 1)
+            for i in range(CHECKSUM_SAMPLE_BLOCKS):
+                f.seek(i * step)
+                digest.update(f.read(CHECKSUM_BLOCK_SIZE))
+    return digest.hexdigest()
+
+def describe_artifact(path):
+    return {"path": path, "size": os.path.getsize(path), "checksum": file_checksum(path)}
+
+def artifact_valid(artifact):
+    path = artifact["path"]
+    try:
+        return os.path.getsize(path) == artifact["size"] and file_checksum(path) == artifact["checksum"]
+    except OSError:
+        return False
+
+def read_json_file(path, default):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+# Written to a temp file of its own and moved into place, so concurrent writers never share one
+# and a reader only ever sees a complete file
+def write_json_file(path, data):
+    handle, temp_file = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(handle, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_file, path)
+    except BaseException:
+        try:
+            os.remove(temp_file)
+        except OSError:
+            pass
+        raise
+
+# Records every finished stage of one file with its output artifacts, so a re-run with the same
+# source and settings can skip stages whose outputs are still on disk and unchanged
+class JobManifest:
+    def __init__(self, path, job):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = read_json_file(path, {})
+        if self.data.get("job") != job:
+            self.data = {"job": job, "stages": {}} # Different source or settings, start over
+
+    # The stage's record if all of its outputs are still valid, otherwise None
+    def completed(self, stage):
+        entry = self.data["stages"].get(stage)
+        if entry and all(artifact_valid(artifact) for artifact in entry["outputs"]):
+            return entry
+        return None
+
+    def record(self, stage, outputs, results):
+        entry = {
+            "outputs": [describe_artifact(path) for path in outputs],
+            "results": results,
+            "finished": time.time()
+        }
+        with self.lock:
+            self.data["stages"][stage] = entry
+            write_json_file(self.path, self.data)
+
+# Index of the sources already processed into an output folder, with the size and mtime they had,
+# so an interrupted batch resumes with the first unfinished file and a replaced source is redone
+def load_batch_state(output_folder):
+    return read_json_file(os.path.join(output_folder, BATCH_STATE_NAME), {"completed": {}})
+
+# The index entry of a finished file, from the source as it is now
+def batch_entry(input_file, output_file, options):
+    stat = os.stat(input_file)
+    return {"output": output_file, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "settings": settings_fingerprint(options)}
+
+def mark_batch_file_complete(output_folder, input_file, output_file, options):
+    entry = batch_entry(input_file, output_file, options)
+    with batch_state_lock: # Read, update and write as one, queue workers finish files on pool threads
+        state = load_batch_state(output_folder)
+        state["completed"][input_file] = entry
+        write_json_file(os.path.join(output_folder, BATCH_STATE_NAME), state)
+
+# Output of an earlier run if the source is unchanged since, it was made with the same settings and
+# it still exists. Entries of older versions have no fingerprints and are redone.
+def completed_output(completed, input_file, options, stat=None):
+    entry = completed.get(input_file)
+    if not isinstance(entry, dict) or entry.get("settings") != settings_fingerprint(options) or not os.path.exists(entry["output"]):
+        return None
+    stat = stat or os.stat(input_file)
+    if (stat.st_size, stat.st_mtime_ns) != (entry["size"], entry["mtime_ns"]):
+        return None
+    return entry["output"]
+
+# Settings that change the encoded output; the pipeline mode only changes how it gets there
+def encode_settings(options):
+    settings = {
+        "quality": options["quality"],
+        "encoding_mode": options["encoding_mode"],
+        "encoding_quality": options["encoding_quality"],
+        "audio_channels": options["audio_channels"],
+        "audio_bitrate": options["audio_bitrate"],
+        "keep_original_audio": options["keep_original_audio"],
+        "cpu_segments": int(options["cpu_segments"])
+    }
+    if options["encode_profile"] != "Standard":
+        settings["encode_profile"] = options["encode_profile"]
+    # Auto-tuned jobs depend on the target instead; kept out otherwise so earlier keys stay valid
+    if options["auto_quality"] != "Off":
+        settings.update(auto_quality=options["auto_quality"], target_size_gb=options["target_size_gb"], target_vmaf=options["target_vmaf"])
+    return settings
+
+def open_output_cache():
+    db = sqlite3.connect(output_cache_file, timeout=30)
+    db.execute("""CREATE TABLE IF NOT EXISTS outputs (
+        output TEXT PRIMARY KEY, cache_key TEXT NOT NULL, source TEXT NOT NULL,
+        size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)""")
+    db.execute("CREATE INDEX IF NOT EXISTS outputs_key ON outputs (cache_key)")
+    return db
+
+# Short hash of the settings that shape the output, kept with every finished file of a batch
+def settings_fingerprint(options):
+    return hashlib.blake2b(json.dumps(encode_settings(options), sort_keys=True).encode(), digest_size=8).hexdigest()
+
+# Size, mtime and sampled-block hash of the source plus the settings that shape the output
+def output_cache_key(input_file, options):
+    stat = os.stat(input_file)
+    fingerprint = [stat.st_size, stat.st_mtime_ns, file_checksum(input_file), encode_settings(options)]
+    return hashlib.blake2b(json.dumps(fingerprint, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+# Most recently used output for the key that is still on disk unchanged; stale entries are dropped
+def lookup_cached_output(cache_key):
+    with closing(open_output_cache()) as db, db:
+        rows = db.execute("SELECT output, size, mtime_ns FROM outputs WHERE cache_key = ? ORDER BY last_used DESC", (cache_key,)).fetchall()
+        for output, size, mtime_ns in rows:
+            try:
+                stat = os.stat(output)
+                if stat.st_size == size and stat.st_mtime_ns == mtime_ns:
+                    db.execute("UPDATE outputs SET last_used = ? WHERE output = ?", (time.time(), output))
+                    return output
+            except OSError:
+                pass
+            db.execute("DELETE FROM outputs WHERE output = ?", (output,))
+    return None
+
+def record_cached_output(cache_key, input_file, output_file, limit_gb=0):
+    stat = os.stat(output_file)
+    now = time.time()
+    with closing(open_output_cache()) as db, db:
+        db.execute("INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                   (os.path.abspath(output_file), cache_key, os.path.abspath(input_file), stat.st_size, stat.st_mtime_ns, now, now))
+        evict_cached_outputs(db, limit_gb)
+
+# Drops least recently used entries beyond the entry and size limits. Only the index entries go,
+# the outputs themselves belong to the user and stay where they are.
+def evict_cached_outputs(db, limit_gb=0):
+    db.execute("DELETE FROM outputs WHERE output NOT IN (SELECT output FROM outputs ORDER BY last_used DESC LIMIT ?)", (OUTPUT_CACHE_MAX_ENTRIES,))
+    if limit_gb:
+        total = 0
+        for output, size in db.execute("SELECT output, size FROM outputs ORDER BY last_used DESC").fetchall():
+            total += size
+            if total > limit_gb * 1024 ** 3:
+                db.execute("DELETE FROM outputs WHERE output = ?", (output,))
+
+# Cache entries as dicts, most recently used first, optionally only those made from one source
+def query_output_cache(source=None):
+    with closing(open_output_cache()) as db:
+        db.row_factory = sqlite3.Row
+        if source is None:
+            rows = db.execute("SELECT * FROM outputs ORDER BY last_used DESC").fetchall()
+        else:
+            rows = db.execute("SELECT * FROM outputs WHERE source = ? ORDER BY last_used DESC", (os.path.abspath(source),)).fetchall()
+        return [dict(row) for row in rows]
+
+# Hard link when source and target share a volume, a copy otherwise
+def link_or_copy(source, target):
+    if os.path.exists(target):
+        if os.path.samefile(source, target):
+            return
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+# Writes the per-file run report to <output folder>/redovi_reports/<name>.json and returns its path
+def write_run_report(output_folder, base_name, report):
+    report["totals"] = sum_process_usage([stage for stage in report["stages"].values() if not stage.get("skipped")])
+    path = os.path.join(output_folder, REPORTS_FOLDER_NAME, f"{base_name}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_json_file(path, report)
+    return path
+
+# Aggregates the run reports of a batch per stage, so hosts and presets can be compared at a glance
+def write_batch_summary(folder, report_paths, started, options):
+    reports = [report for report in (read_json_file(path, None) for path in report_paths) if report]
+    stages = {}
+    for report in reports:
+        for name, stage in report["stages"].items():
+            if not stage.get("skipped"):
+                stages.setdefault(name, []).append(stage)
+    summary = {
+        "host": platform.node(),
+        "started": started,
+        "seconds": round(time.time() - started, 1),
+        "settings": dict(encode_settings(options), pipeline_mode=options["pipeline_mode"], parallel_files=options["parallel_files"]),
+        "files": [{"file": report["file"], "status": report["status"], "seconds": report.get("seconds"), "report": path}
+                  for path, report in zip(report_paths, reports)],
+        "stages": {},
+        "totals": sum_process_usage([report["totals"] for report in reports])
+    }
+    for name, runs in stages.items():
+        wall_seconds = sum(run["wall_seconds"] for run in runs)
+        stage = {"runs": len(runs), "wall_seconds": round(wall_seconds, 3)}
+        stage.update(sum_process_usage(runs))
+        if stage.get("cpu_seconds") is not None and wall_seconds:
+            stage["cpu_utilization"] = round(stage["cpu_seconds"] / wall_seconds, 2)
+        if stage.get("frames") and wall_seconds:
+            stage["fps"] = round(stage["frames"] / wall_seconds, 2)
+        summary["stages"][name] = stage
+    path = os.path.join(folder, REPORTS_FOLDER_NAME, time.strftime("batch_%Y%m%d_%H%M%S.json", time.localtime(started)))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_json_file(path, summary)
+    return path
+
+class StageScheduler:
+    def __init__(self, limits):
+        slot_limits = dict(DEFAULT_SLOT_LIMITS)
+        slot_limits.update(limits)
+        self.slots = {name: threading.BoundedSemaphore(max(1, int(count))) for name, count in slot_limits.items()}
+        self.space_condition = threading.Condition()
+        self.space_reservations = {} # Reservation of every admitted job -> (temp folder, estimated peak bytes)
+
+    # Bytes the admitted jobs on the same volume may still write
+    def outstanding_space(self, device):
+        outstanding = 0
+        for folder, needed in self.space_reservations.values():
+            if os.stat(folder).st_dev == device:
+                outstanding += max(0, needed - folder_size(folder))
+        return outstanding
+
+    # Admit a job once the scratch volume can hold its estimated peak next to what the running jobs
+    # may still write. A job that can't fit even on an otherwise idle volume fails right away.
+    @contextmanager
+    def scratch_space(self, temp_folder, needed, on_wait=None):
+        device = os.stat(temp_folder).st_dev
+        with self.space_condition:
+            while True:
+                available = shutil.disk_usage(temp_folder).free - SCRATCH_HEADROOM_BYTES - self.outstanding_space(device)
+                missing = needed - folder_size(temp_folder) - available # A resumed job already wrote part of it
+                if missing <= 0:
+                    break
+                if not self.space_reservations:
+                    raise OSError(errno.ENOSPC, f"Not enough free space for temp files in {os.path.dirname(temp_folder)}: "
+                                  f"{format_size(needed)} needed, {format_size(max(0, available))} available")
+                current_cancel_token().raise_if_cancelled()
+                if on_wait:
+                    on_wait(missing)
+                self.space_condition.wait(timeout=5) # Also re-check now and then, other programs free space too
+            reservation = object() # Per job, so two jobs on one folder can't release each other's
+            self.space_reservations[reservation] = (temp_folder, needed)
+        try:
+            yield
+        finally:
+            with self.space_condition:
+                del self.space_reservations[reservation]
+                self.space_condition.notify_all()
+
+    # Hold a slot on the given resource for the duration of a stage
+    @contextmanager
+    def slot(self, resource):
+        if resource is None: # Cheap stages don't need a slot
+            yield
+            return
+        semaphore = self.slots[resource]
+        while not semaphore.acquire(timeout=0.5):
+            current_cancel_token().raise_if_cancelled()
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def run_stage(self, resource, func, token):
+        with cancelling(token), self.slot(resource):
+            func()
+
+    # Run one file's stages as a dependency graph. stages maps a name to (dependencies, resource, func);
+    # each stage starts as soon as everything it depends on has finished and its resource has a free slot.
+    # The first failure cancels token, which stops the stages still running and frees their slots.
+    def run_graph(self, stages, token=None):
+        token = token or CancelToken(current_cancel_token())
+        pending = dict(stages)
+        running = {}
+        done = set()
+        errors = []
+        with ThreadPoolExecutor(max_workers=len(stages)) as pool:
+            while pending or running:
+                if not errors: # After a failure nothing new starts
+                    for name, (dependencies, resource, func) in list(pending.items()):
+                        if all(dependency in done for dependency in dependencies):
+                            running[pool.submit(self.run_stage, resource, func, token)] = name
+                            del pending[name]
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                        done.add(name)
+                    except Exception as e:
+                        errors.append(e)
+                        token.cancel()
+        if errors:
+            raise errors[0]
+        if pending:
+            raise ValueError(f"Unresolvable stage dependencies: {', '.join(pending)}")
+
+def emit(on_event, event, **fields):
+    if on_event is not None:
+        on_event(dict(event=event, time=time.time(), **fields))
+
+# Settings from config.json (or the CLI) on top of the defaults
+def resolve_options(options):
+    resolved = dict(DEFAULT_SETTINGS)
+    resolved.update({key: value for key, value in (options or {}).items() if value is not None})
+    return resolved
+
+# Source videos under folder as os.DirEntry objects. scandir returns the file type with the listing
+# and caches stat(), so large trees are walked without extra system calls per file. Outputs of
+# this tool are left out, they end up next to their sources when no output folder is set.
+def scan_video_files(folder, recursive=False):
+    folders = [folder]
+    while folders:
+        try:
+            entries = list(os.scandir(folders.pop()))
+        except OSError:
+            continue # Removed or unreadable since it was listed
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if recursive and entry.name not in SCAN_SKIP_FOLDERS:
+                    folders.append(entry.path)
+            elif entry.name.lower().endswith(VIDEO_EXTENSIONS) and not entry.name.endswith(OUTPUT_SUFFIX) and entry.is_file():
+                yield entry
+
+def find_video_files(folder, recursive=False):
+    return sorted(entry.path for entry in scan_video_files(folder, recursive))
+
+# Process one source into <name>_ReDoVi.mkv in output_folder and return the output path.
+# options uses the config.json keys; progress and stage events are passed to on_event as dicts.
+def process_video_file(input_file, output_folder, options=None, on_event=None, scheduler=None):
+    options = resolve_options(options)
+    if scheduler is None:
+        scheduler = StageScheduler(hardware_slot_limits(options["slot_limits"]))
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+    output_file = os.path.join(output_folder, base_name + OUTPUT_SUFFIX)
+
+    cache_key = None
+    if options["output_cache"] == "Reuse":
+        cache_key = output_cache_key(input_file, options)
+        cached_output = lookup_cached_output(cache_key)
+        if cached_output:
+            os.makedirs(output_folder, exist_ok=True)
+            link_or_copy(cached_output, output_file)
+            record_cached_output(cache_key, input_file, output_file, options["output_cache_limit_gb"])
+            emit(on_event, "file_cached", file=input_file, output=output_file, cached_output=cached_output)
+            return output_file
+
+    # One temp folder per file so parallel jobs never share or delete each other's files
+    temp_root = options["scratch_folder"] or os.path.join(output_folder, "temp")
+    temp_folder = job_temp_folder(temp_root, input_file, output_folder)
+    os.makedirs(temp_folder, exist_ok=True)
+    progress = lambda value, text, **stats: emit(on_event, "progress", file=input_file, percent=value, message=text, **stats)
+    succeeded = False
+    report = {
+        "file": os.path.abspath(input_file),
+        "output": output_file,
+        "host": platform.node(),
+        "started": time.time(),
+        "settings": dict(encode_settings(options), pipeline_mode=options["pipeline_mode"]),
+        "stages": {}
+    }
+    start_time = time.monotonic()
+    # Every tool of the job runs under its own token: a failed stage stops its siblings, Abort stops all
+    job_token = CancelToken(abort_token)
+    previous_token = getattr(cancel_state, "token", None)
+    cancel_state.token = job_token
+
+    try:
+        paths = {
+            'hevc': os.path.join(temp_folder, f"{base_name}_temp.hevc"),
+            'metadata': os.path.join(temp_folder, f"{base_name}_rpu.bin"),
+            'probe_metadata': os.path.join(temp_folder, f"{base_name}_probe_rpu.bin"),
+            'reencoded_hevc': os.path.join(temp_folder, f"{base_name}_reencoded.hevc"),
+            'final_hevc': os.path.join(temp_folder, f"{base_name}_final.hevc"),
+            'side_tracks': os.path.join(temp_folder, f"{base_name}_tracks.mkv"),
+            'remuxed': os.path.join(temp_folder, base_name + OUTPUT_SUFFIX),
+            'output': output_file
+        }
+
+        streamed = options["pipeline_mode"] == "Streamed"
+        cpu_segments = int(options["cpu_segments"])
+        emit(on_event, "file_start", file=input_file, output=paths['output'])
+
+        results = {}
+        def probe():
+            results['media_info'] = probe_media(input_file)
+
+        def check_dovi():
+            progress(0, "Checking for Dolby Vision...")
+            rpu_profile = probe_dovi(input_file, paths['probe_metadata'])
+            if rpu_profile is None:
+                raise ValueError("No Dolby Vision metadata found in the source file")
+            # A profile the output can't carry would only show up after the encode, at injection
+            validate_profile(rpu_profile, results['media_info'].dv_profile)
+
+        def extract_metadata():
+            if streamed:
+                progress(0, "Demuxing and extracting metadata...")
+                extract_dovi_metadata_streamed(input_file, paths['metadata'])
+            else:
+                progress(0, "Demuxing DoVi RPU...")
+                extract_hevc_stream(input_file, paths['hevc'])
+
+                progress(10, "Extracting metadata...")
+                extract_dovi_metadata(paths['hevc'], paths['metadata'])
+
+        def encode_with(mode):
+            preset = preset_for_mode(mode, options["encoding_quality"])
+            profile = select_encode_profile(options["encode_profile"], mode)
+            report["encode_profile"] = {"mode": mode, "profile": profile, "params": ENCODE_PROFILES[profile].get(mode, {})}
+            quality = options["quality"]
+            if options["auto_quality"] != "Off":
+                tuning = tune_quality(input_file, results['media_info'], options, mode, preset,
+                                      os.path.join(temp_folder, "samples"), lambda text: progress(20, text), profile)
+                report["quality_tuning"] = tuning
+                emit(on_event, "quality_tuned", file=input_file, **tuning)
+                quality = tuning["quality"]
+            if mode == "CPU" and cpu_segments > 1:
+                return reencode_video_segmented(
+                    input_file,
+                    paths['reencoded_hevc'],
+                    quality,
+                    preset,
+                    cpu_segments,
+                    os.path.join(temp_folder, "segments"),
+                    lambda p, stats: progress(20 + p * 0.7, "Transcoding segments...", **stats),
+                    profile,
+                    results['media_info']
+                )
+            return reencode_video(
+                input_file,
+                results['media_info'],
+                paths['reencoded_hevc'],
+                quality,
+                mode,
+                preset,
+                lambda p, stats: progress(20 + p * 0.7, "Transcoding...", **stats),
+                hw_decode=detect_capabilities()["hw_decode"].get(mode, False),
+                profile=profile
+            )["frame"]
+
+        def encode():
+            progress(20, "Transcoding video...")
+            # Modes this host can't run are skipped up front; one that fails anyway hands over to the next
+            modes = encoding_mode_chain(options["encoding_mode"])
+            for mode in modes:
+                if mode != options["encoding_mode"]:
+                    emit(on_event, "encoder_fallback", file=input_file, requested=options["encoding_mode"], mode=mode)
+                try:
+                    with scheduler.slot(ENCODER_RESOURCES.get(mode, "cpu_encode")):
+                        results['encoded_frames'] = encode_with(mode)
+                    break
+                except subprocess.CalledProcessError:
+                    if mode == modes[-1]:
+                        raise
+                    recheck_encoder_mode(mode)
+
+        def inject():
+            # dovi_tool needs a real file to interleave the RPUs, so injection always reads from temp
+            # A frame count mismatch would only show up as desynced metadata after the remux
+            if results['encoded_frames']:
+                validate_frame_alignment(paths['metadata'], results['encoded_frames'])
+            progress(95, "Injecting metadata...")
+            inject_dovi_metadata(paths['reencoded_hevc'], paths['metadata'], paths['final_hevc'])
+
+        def audio():
+            results['side_track_file'] = extract_side_tracks(
+                input_file,
+                results['media_info'],
+                paths['side_tracks'],
+                options["audio_channels"],
+                options["audio_bitrate"],
+                options["keep_original_audio"]
+            )
+
+        def remux():
+            progress(98, "Remuxing...")
+            remux_video(
+                paths['final_hevc'],
+                results['side_track_file'],
+                input_file,
+                results['media_info'],
+                paths['remuxed']
+            )
+            os.makedirs(output_folder, exist_ok=True)
+            move_to_destination(paths['remuxed'], paths['output'])
+
+        # Stages finished by an earlier run with the same source and settings are skipped
+        source_stat = os.stat(input_file)
+        manifest = JobManifest(os.path.join(temp_folder, JOB_MANIFEST_NAME), {
+            "source": os.path.abspath(input_file),
+            "size": source_stat.st_size,
+            "mtime_ns": source_stat.st_mtime_ns,
+            "settings": dict(encode_settings(options), pipeline_mode=options["pipeline_mode"])
+        })
+
+        # Resource usage of the tools a stage runs ends up in the run report
+        def traced(name, func):
+            def run():
+                trace = StageTrace(name)
+                stage_start = time.monotonic()
+                try:
+                    with tracing(trace):
+                        func()
+                finally:
+                    report["stages"][name] = trace.summary(time.monotonic() - stage_start)
+            return run
+
+        # outputs returns the stage's artifacts once it has run; result_keys are restored on a skip
+        def checkpointed(name, func, outputs=lambda: [], result_keys=()):
+            def run():
+                entry = manifest.completed(name)
+                if entry is not None:
+                    results.update(entry["results"])
+                    report["stages"][name] = {"skipped": True}
+                    emit(on_event, "stage_skipped", file=input_file, stage=name)
+                    return
+                stage_start = time.monotonic()
+                emit(on_event, "stage_start", file=input_file, stage=name)
+                traced(name, func)()
+                manifest.record(name, outputs(), {key: results[key] for key in result_keys})
+                emit(on_event, "stage_end", file=input_file, stage=name, seconds=round(time.monotonic() - stage_start, 3))
+            return run
+
+        side_tracks = lambda: [results['side_track_file']] if results['side_track_file'] else []
+
+        # Audio and RPU extraction only need the source, so they run alongside the video encode
+        stages = {
+            'check_dovi': ((), None, checkpointed('check_dovi', check_dovi)),
+            'extract_metadata': (('check_dovi',), "disk", checkpointed('extract_metadata', extract_metadata, lambda: [paths['metadata']])),
+            'encode': (('check_dovi',), None, checkpointed('encode', encode, lambda: [paths['reencoded_hevc']], ('encoded_frames',))),
+            'audio': (('check_dovi',), "disk", checkpointed('audio', audio, side_tracks, ('side_track_file',))),
+            'inject': (('extract_metadata', 'encode'), "disk", checkpointed('inject', inject, lambda: [paths['final_hevc']])),
+            'remux': (('inject', 'audio'), "disk", checkpointed('remux', remux, lambda: [paths['output']]))
+        }
+        # The source size from the probe decides how much scratch space the job is admitted with
+        traced('probe', probe)()
+        needed = estimate_scratch_bytes(results['media_info'], options)
+        waiting = lambda missing: progress(0, f"Waiting for {format_size(missing)} of free temp space...")
+        with scheduler.scratch_space(temp_folder, needed, waiting):
+            scheduler.run_graph(stages, job_token)
+
+        elapsed = time.monotonic() - start_time
+        peak_temp = folder_size(temp_folder) # Nothing is deleted before cleanup, so this is the peak
+        record_pipeline_stats({
+            "file": input_file,
+            "pipeline_mode": options["pipeline_mode"],
+            "encoding_mode": options["encoding_mode"],
+            "seconds": round(elapsed, 1),
+            "peak_temp_bytes": peak_temp
+        })
+        if cache_key:
+            record_cached_output(cache_key, input_file, paths['output'], options["output_cache_limit_gb"])
+        # Encode speed relative to realtime, which the tools' own fps can't tell on their own
+        frame_rate = results['media_info'].frame_rate
+        for stage in report["stages"].values():
+            if stage.get("fps") and frame_rate:
+                stage["speed"] = round(stage["fps"] / frame_rate, 2)
+        report.update(status="done", seconds=round(elapsed, 1), peak_temp_bytes=peak_temp)
+        report_path = write_run_report(output_folder, base_name, report)
+        progress(100, "Done")
+        emit(on_event, "file_done", file=input_file, output=paths['output'], seconds=round(elapsed, 1), peak_temp_bytes=peak_temp, report=report_path)
+        succeeded = True
+        return paths['output']
+    except Exception as e:
+        report.update(status="aborted" if abort_process else "failed", error=str(e), seconds=round(time.monotonic() - start_time, 1))
+        try:
+            report_path = write_run_report(output_folder, base_name, report)
+        except OSError:
+            report_path = None # Don't hide the job's own error behind the report's
+        emit(on_event, "file_failed", file=input_file, error=str(e), report=report_path)
+        raise
+    finally:
+        cancel_state.token = previous_token
+        job_token.close()
+        # Keeping the temp folder of a failed job lets the next run resume from its last finished stage
+        if succeeded or options["failed_temp"] == "Delete Temp":
+            if os.path.exists(temp_folder):
+                shutil.rmtree(temp_folder) # Cleanup temp folder after each file processing
+            if not options["scratch_folder"]:
+                try:
+                    os.rmdir(temp_root) # Only succeeds once the last parallel job is done
+                except OSError:
+                    pass
+
+# Process several sources in parallel. Each file goes to output_folder, or next to the source when
+# it is None. Files finished by an earlier, interrupted run of the same batch are skipped.
+# Returns (processed, total, skipped); failures are reported as file_failed events.
+def process_batch(input_files, output_folder=None, options=None, on_event=None):
+    options = resolve_options(options)
+    scheduler = StageScheduler(hardware_slot_limits(options["slot_limits"]))
+    total_files = len(input_files)
+    output_for = lambda input_file: output_folder if output_folder else os.path.dirname(input_file)
+    started = time.time()
+
+    # The run reports of the files are collected for the batch summary
+    report_paths = []
+    def file_event(event):
+        if event["event"] in ("file_done", "file_failed") and event.get("report"):
+            report_paths.append(event["report"])
+        if on_event:
+            on_event(event)
+
+    # The index of every output folder is read once, not once per file
+    states = {}
+    pending = []
+    for input_file in input_files:
+        folder = output_for(input_file)
+        if folder not in states:
+            states[folder] = load_batch_state(folder)
+        output_file = completed_output(states[folder]["completed"], input_file, options)
+        if output_file:
+            emit(on_event, "file_skipped", file=input_file, output=output_file)
+        else:
+            pending.append(input_file)
+    skipped_count = total_files - len(pending)
+    processed_count = skipped_count
+
+    # Every file runs on its own worker; the scheduler's slots decide which stages overlap
+    with ThreadPoolExecutor(max_workers=max(1, int(options["parallel_files"]))) as pool:
+        futures = {
+            pool.submit(process_video_file, input_file, output_for(input_file), options, file_event, scheduler): input_file
+            for input_file in pending
+        }
+        for future in as_completed(futures):
+            input_file = futures[future]
+            try:
+                output_file = future.result()
+            except Exception:
+                continue # Already reported through the file_failed event
+            mark_batch_file_complete(output_for(input_file), input_file, output_file, options)
+            processed_count += 1
+
+    summary_path = write_batch_summary(output_for(input_files[0]), report_paths, started, options) if report_paths else None
+    emit(on_event, "batch_done", processed=processed_count, total=total_files, skipped=skipped_count, aborted=abort_process, report=summary_path)
+    return processed_count, total_files, skipped_count
+
+# Drop-folder mode: keep scanning folder and process every new or changed source once it stopped
+# growing, until aborted. Sources already in the index of their output folder are not redone, and
+# a source that failed is only retried after it changes. Returns (processed, failed).
+def watch_folder(folder, output_folder=None, options=None, on_event=None, recursive=True, interval=WATCH_INTERVAL):
+    options = resolve_options(options)
+    scheduler = StageScheduler(hardware_slot_limits(options["slot_limits"]))
+    output_for = lambda input_file: output_folder if output_folder else os.path.dirname(input_file)
+    states = {}
+    known = {} # Source -> (size, mtime_ns) it had when it was queued or found done
+    candidates = {} # New or changed source -> ((size, mtime_ns), scans it stayed unchanged)
+    running = {}
+    processed_count = failed_count = 0
+    emit(on_event, "watch_start", folder=folder, recursive=recursive, interval=interval)
+
+    with ThreadPoolExecutor(max_workers=max(1, int(options["parallel_files"]))) as pool:
+        while not abort_process:
+            present = set()
+            for entry in scan_video_files(folder, recursive):
+                input_file = entry.path
+                present.add(input_file)
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue # Removed since the listing
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if known.get(input_file) == signature or input_file in running.values():
+                    continue # Unchanged, or changed while its job is running; looked at again after
+                out_folder = output_for(input_file)
+                if out_folder not in states:
+                    states[out_folder] = load_batch_state(out_folder)
+                if input_file not in candidates and completed_output(states[out_folder]["completed"], input_file, options, stat):
+                    known[input_file] = signature
+                    continue
+                previous, scans = candidates.get(input_file, (None, 0))
+                scans = scans + 1 if signature == previous else 0
+                if scans < WATCH_STABLE_SCANS:
+                    candidates[input_file] = (signature, scans)
+                    continue
+                del candidates[input_file]
+                known[input_file] = signature
+                emit(on_event, "file_queued", file=input_file)
+                future = pool.submit(process_video_file, input_file, out_folder, options, on_event, scheduler)
+                running[future] = input_file
+            for input_file in set(candidates) - present:
+                del candidates[input_file] # Deleted or renamed while still copying
+
+            deadline = time.monotonic() + interval
+            while not abort_process and time.monotonic() < deadline:
+                for future in [f for f in running if f.done()]:
+                    input_file = running.pop(future)
+                    try:
+                        output_file = future.result()
+                    except Exception:
+                        failed_count += 1 # Already reported through the file_failed event
+                        continue
+                    mark_batch_file_complete(output_for(input_file), input_file, output_file, options)
+                    processed_count += 1
+                time.sleep(min(1, interval))
+
+    emit(on_event, "watch_done", folder=folder, processed=processed_count, failed=failed_count)
+    return processed_count, failed_count
+
+def open_job_queue():
+    db = sqlite3.connect(job_queue_file, timeout=30, isolation_level=None)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL") # Status queries don't wait for a worker's claim
+    db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY, source TEXT NOT NULL, output_folder TEXT, options TEXT NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 0, status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, not_before REAL NOT NULL DEFAULT 0,
+        worker TEXT, lease_until REAL, created REAL NOT NULL, started REAL, finished REAL,
+        output TEXT, error TEXT, report TEXT)""")
+    db.execute("CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority DESC, id)")
+    db.execute("CREATE INDEX IF NOT EXISTS jobs_source ON jobs (source)")
+    # Sources finished into an output folder, like redovi_batch.json but safe for any number of workers
+    db.execute("""CREATE TABLE IF NOT EXISTS completed (
+        source TEXT NOT NULL, output_folder TEXT NOT NULL, output TEXT NOT NULL, size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL, settings TEXT NOT NULL, PRIMARY KEY (source, output_folder))""")
+    return db
+
+# One write transaction; BEGIN IMMEDIATE takes the write lock up front, so two workers can never
+# read the same queued job and both claim it
+@contextmanager
+def job_queue_transaction():
+    with closing(open_job_queue()) as db:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+def job_from_row(row):
+    job = dict(row)
+    job["options"] = json.loads(job["options"])
+    return job
+
+# Adds sources with the full option set they are to be encoded with and returns their job ids.
+# Higher priorities are claimed first, equal ones in the order they were added. A source that is
+# still waiting for the same output folder gets the new options instead of a second job.
+def enqueue_jobs(input_files, output_folder=None, options=None, priority=0, max_attempts=JOB_MAX_ATTEMPTS):
+    options_json = json.dumps(resolve_options(options), sort_keys=True)
+    output_folder = os.path.abspath(output_folder) if output_folder else None
+    job_ids = []
+    with job_queue_transaction() as db:
+        for input_file in input_files:
+            input_file = os.path.abspath(input_file)
+            row = db.execute("SELECT id, status FROM jobs WHERE source = ? AND output_folder IS ? AND status IN ('queued', 'running')",
+                             (input_file, output_folder)).fetchone()
+            if row is None:
+                cursor = db.execute("INSERT INTO jobs (source, output_folder, options, priority, max_attempts, created) VALUES (?, ?, ?, ?, ?, ?)",
+                                    (input_file, output_folder, options_json, priority, max_attempts, time.time()))
+                job_ids.append(cursor.lastrowid)
+                continue
+            if row["status"] == "queued":
+                db.execute("UPDATE jobs SET options = ?, priority = MAX(priority, ?), max_attempts = ? WHERE id = ?",
+                           (options_json, priority, max_attempts, row["id"]))
+            job_ids.append(row["id"])
+    return job_ids
+
+# Takes the next job for worker: the highest priority queued job that isn't waiting for a retry.
+# Jobs whose worker stopped renewing their lease are given back to the queue first.
+def claim_job(worker):
+    now = time.time()
+    with job_queue_transaction() as db:
+        db.execute("""UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                      worker = NULL, lease_until = NULL, finished = CASE WHEN attempts < max_attempts THEN NULL ELSE ? END,
+                      error = 'Worker stopped responding' WHERE status = 'running' AND lease_until < ?""", (now, now))
+        row = db.execute("SELECT * FROM jobs WHERE status = 'queued' AND not_before <= ? ORDER BY priority DESC, id LIMIT 1", (now,)).fetchone()
+        if row is None:
+            return None
+        db.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, lease_until = ?, started = ?, finished = NULL WHERE id = ?",
+                   (worker, now + JOB_LEASE_SECONDS, now, row["id"]))
+    return dict(job_from_row(row), status="running", attempts=row["attempts"] + 1, worker=worker, started=now)
+
+def renew_job_leases(job_ids, worker):
+    if job_ids:
+        with job_queue_transaction() as db:
+            db.executemany("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                           [(time.time() + JOB_LEASE_SECONDS, job_id, worker) for job_id in job_ids])
+
+# Marks the job done and records its source as finished into the output folder, in one transaction
+def complete_job(job, output_folder, output_file, report_path=None):
+    try:
+        entry = batch_entry(job["source"], output_file, job["options"])
+    except OSError:
+        entry = None # Source removed since; the job is still done
+    with job_queue_transaction() as db:
+        db.execute("UPDATE jobs SET status = 'done', output = ?, report = ?, error = NULL, finished = ?, worker = NULL, lease_until = NULL WHERE id = ?",
+                   (output_file, report_path, time.time(), job["id"]))
+        if entry:
+            db.execute("INSERT OR REPLACE INTO completed (source, output_folder, output, size, mtime_ns, settings) VALUES (?, ?, ?, ?, ?, ?)",
+                       (job["source"], output_folder, output_file, entry["size"], entry["mtime_ns"], entry["settings"]))
+
+# What the queue recorded for a source in an output folder, in the form of redovi_batch.json
+def queue_completed(input_file, output_folder):
+    with closing(open_job_queue()) as db:
+        row = db.execute("SELECT output, size, mtime_ns, settings FROM completed WHERE source = ? AND output_folder = ?",
+                         (input_file, output_folder)).fetchone()
+    return {input_file: dict(row)} if row else {}
+
+# A transient failure is queued again after JOB_RETRY_DELAY, 2x, 4x... seconds until the job runs
+# out of attempts. Returns the job's new status and the time of the retry (None when it failed).
+def fail_job(job_id, error, transient, report_path=None):
+    now = time.time()
+    with job_queue_transaction() as db:
+        attempts, max_attempts = db.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if transient and attempts < max_attempts:
+            retry_at = now + JOB_RETRY_DELAY * 2 ** (attempts - 1)
+            db.execute("UPDATE jobs SET status = 'queued', not_before = ?, error = ?, report = ?, worker = NULL, lease_until = NULL WHERE id = ?",
+                       (retry_at, error, report_path, job_id))
+            return "queued", retry_at
+        db.execute("UPDATE jobs SET status = 'failed', error = ?, report = ?, finished = ?, worker = NULL, lease_until = NULL WHERE id = ?",
+                   (error, report_path, now, job_id))
+    return "failed", None
+
+# An aborted job goes back to the queue without using up an attempt
+def release_job(job_id):
+    with job_queue_transaction() as db:
+        db.execute("UPDATE jobs SET status = 'queued', attempts = MAX(0, attempts - 1), worker = NULL, lease_until = NULL WHERE id = ? AND status = 'running'", (job_id,))
+
+def set_job_priority(job_id, priority):
+    with job_queue_transaction() as db:
+        return db.execute("UPDATE jobs SET priority = ? WHERE id = ? AND status = 'queued'", (priority, job_id)).rowcount == 1
+
+# Only waiting jobs can be cancelled; a running one is stopped with the worker's abort
+def cancel_job(job_id):
+    with job_queue_transaction() as db:
+        return db.execute("UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ? AND status = 'queued'", (time.time(), job_id)).rowcount == 1
+
+# Queues a failed or cancelled job again with all its attempts
+def retry_job(job_id):
+    with job_queue_transaction() as db:
+        return db.execute("UPDATE jobs SET status = 'queued', attempts = 0, not_before = 0, finished = NULL WHERE id = ? AND status IN ('failed', 'cancelled')",
+                          (job_id,)).rowcount == 1
+
+# Removes finished jobs from the queue; the outputs and reports stay
+def clear_jobs(statuses=("done", "cancelled")):
+    with job_queue_transaction() as db:
+        return db.execute(f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(statuses))})", tuple(statuses)).rowcount
+
+# Jobs as dicts in claim order, optionally only those with one status or source
+def query_jobs(status=None, source=None, limit=None):
+    query, args = "SELECT * FROM jobs", []
+    conditions = []
+    if status is not None:
+        conditions.append("status = ?")
+        args.append(status)
+    if source is not None:
+        conditions.append("source = ?")
+        args.append(os.path.abspath(source))
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY priority DESC, id"
+    if limit is not None:
+        query += " LIMIT ?"
+        args.append(limit)
+    with closing(open_job_queue()) as db:
+        return [job_from_row(row) for row in db.execute(query, args).fetchall()]
+
+# Number of jobs per status, every status included
+def job_counts():
+    with closing(open_job_queue()) as db:
+        counts = dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+    return {status: counts.get(status, 0) for status in JOB_STATUSES}
+
+# Time the next queued job can be claimed at, None when nothing is queued
+def next_job_time():
+    with closing(open_job_queue()) as db:
+        return db.execute("SELECT MIN(not_before) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+# Timeouts, and tool or I/O errors that TRANSIENT_ERRNOS / TRANSIENT_TOOL_ERRORS describe as passing
+def is_transient_failure(error):
+    if isinstance(error, subprocess.TimeoutExpired):
+        return True
+    if isinstance(error, subprocess.CalledProcessError):
+        message = error.stderr if isinstance(error.stderr, str) else (error.stderr or b"").decode(errors="replace")
+        return bool(TRANSIENT_TOOL_ERRORS.search(message))
+    return isinstance(error, OSError) and error.errno in TRANSIENT_ERRNOS
+
+# Runs one claimed job with its own options and records how it ended; returns the job's new status
+def run_claimed_job(job, scheduler, on_event):
+    input_file = job["source"]
+    output_folder = job["output_folder"] or os.path.dirname(input_file)
+    report_path = None
+    def job_event(event):
+        nonlocal report_path
+        if event["event"] in ("file_done", "file_failed"):
+            report_path = event.get("report")
+        if on_event:
+            on_event(event)
+
+    try:
+        # Only an output made with the settings this job was queued with counts as done
+        output_file = (completed_output(queue_completed(input_file, output_folder), input_file, job["options"])
+                       or completed_output(load_batch_state(output_folder)["completed"], input_file, job["options"]))
+        if output_file:
+            emit(on_event, "file_skipped", file=input_file, output=output_file)
+        else:
+            output_file = process_video_file(input_file, output_folder, job["options"], job_event, scheduler)
+    except Exception as e:
+        if abort_process:
+            release_job(job["id"])
+            return "queued"
+        status, retry_at = fail_job(job["id"], str(e), is_transient_failure(e), report_path)
+        if status == "queued":
+            emit(on_event, "job_retry", file=input_file, job=job["id"], attempt=job["attempts"], retry_in=round(retry_at - time.time()), error=str(e))
+        return status
+    complete_job(job, output_folder, output_file, report_path)
+    # The queue has the job's record; redovi_batch.json is for batch and watch runs and can't fail
+    # a job whose output is already there
+    try:
+        mark_batch_file_complete(output_folder, input_file, output_file, job["options"])
+    except OSError:
+        pass
+    return "done"
+
+# Worker: claims jobs from the queue and runs up to parallel_files of them at once, each with the
+# options it was queued with. The worker's own options only set the slot limits and parallel_files.
+# Returns (processed, failed) once the queue is empty, or when aborted with keep_running.
+def run_job_queue(options=None, on_event=None, keep_running=False, poll_interval=JOB_POLL_INTERVAL):
+    options = resolve_options(options)
+    scheduler = StageScheduler(hardware_slot_limits(options["slot_limits"]))
+    workers = max(1, int(options["parallel_files"]))
+    worker = f"{platform.node()}:{os.getpid()}"
+    token = abort_token
+    running = {}
+    processed_count = failed_count = 0
+    started = time.time()
+
+    # The run reports of the jobs are collected for a batch summary in each output folder
+    report_paths = {}
+    def job_event(event):
+        if event["event"] in ("file_done", "file_failed") and event.get("report"):
+            report_paths.setdefault(os.path.dirname(os.path.dirname(event["report"])), []).append(event["report"])
+        if on_event:
+            on_event(event)
+
+    # Leases are renewed well before they run out, while stages may go a long time without an event
+    stop_renewing = threading.Event()
+    def renew_leases():
+        while not stop_renewing.wait(JOB_LEASE_SECONDS / 4):
+            renew_job_leases([job["id"] for job in list(running.values())], worker)
+    renewer = threading.Thread(target=renew_leases, daemon=True)
+    renewer.start()
+
+    emit(on_event, "queue_start", worker=worker, counts=job_counts())
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while not token.cancelled:
+                while len(running) < workers:
+                    job = claim_job(worker)
+                    if job is None:
+                        break
+                    emit(on_event, "job_claimed", file=job["source"], job=job["id"], attempt=job["attempts"], priority=job["priority"])
+                    running[pool.submit(run_claimed_job, job, scheduler, job_event)] = job
+                if running:
+                    finished, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                else:
+                    next_time = next_job_time()
+                    if next_time is None and not keep_running:
+                        break
+                    # Idle until the next retry is due or new jobs may have been added
+                    token.event.wait(min(poll_interval, max(0, next_time - time.time())) if next_time is not None else poll_interval)
+                    finished = []
+                for future in finished:
+                    del running[future]
+                    status = future.result()
+                    processed_count += status == "done"
+                    failed_count += status == "failed"
+            for future in running: # Aborted; the jobs that didn't finish went back to the queue
+                status = future.result()
+                processed_count += status == "done"
+                failed_count += status == "failed"
+    finally:
+        stop_renewing.set()
+    summary_paths = [write_batch_summary(folder, paths, started, options) for folder, paths in report_paths.items()]
+    emit(on_event, "queue_done", worker=worker, processed=processed_count, failed=failed_count, aborted=token.cancelled,
+         counts=job_counts(), reports=summary_paths)
+    return processed_count, failed_count
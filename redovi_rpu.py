@@ -0,0 +1,290 @@
+import mmap
+from dataclasses import dataclass, field
+
+# Reader for the RPU .bin files written by "dovi_tool extract-rpu". The file is an Annex-B
+# stream with one UNSPEC62 NAL unit per frame, so frames can be counted by scanning for start
+# codes in a memory map without reading the payloads. Only the parts of each RPU that the
+# pipeline checks are decoded: the header (profile) and the L1/L6 display management blocks.
+
+RPU_NAL_HEADER = b'\x7c\x01' # nal_unit_type 62 (UNSPEC62), layer 0, temporal id 0
+RPU_PREFIX = 0x19
+START_CODE = b'\x00\x00\x01'
+
+# dovi_tool -m 4 converts the RPU of profile 7 and 8 sources to profile 8, the single-layer
+# profile the re-encoded video is injected with
+OUTPUT_PROFILE = 8
+CONVERTIBLE_PROFILES = (7, 8)
+
+class RpuError(ValueError):
+    pass
+
+@dataclass
+class RpuFrame:
+    index: int
+    profile: int
+    scene_refresh: bool = False
+    min_pq: int = None # L1, per frame
+    max_pq: int = None
+    avg_pq: int = None
+    max_cll: int = None # L6, static for the whole stream
+    max_fall: int = None
+
+@dataclass
+class RpuInfo:
+    path: str
+    frame_count: int
+    profile: int = 0
+    scene_count: int = 0
+    max_pq: int = None # Highest L1 max_pq of any frame
+    max_avg_pq: int = None
+    max_cll: int = None
+    max_fall: int = None
+    frames: list = field(default_factory=list)
+
+# (start, end) of every NAL unit in the buffer; nothing is copied
+def iter_nal_units(buffer):
+    position = buffer.find(START_CODE)
+    while position != -1:
+        start = position + 3
+        position = buffer.find(START_CODE, start)
+        end = len(buffer) if position == -1 else position
+        # A 4-byte start code leaves its leading zero at the end of the previous unit
+        while end > start and buffer[end - 1] == 0:
+            end -= 1
+        yield start, end
+
+def open_rpu_file(path):
+    with open(path, "rb") as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return b'' # mmap refuses empty files
+
+def count_rpu_frames(path):
+    buffer = open_rpu_file(path)
+    try:
+        return sum(1 for start, end in iter_nal_units(buffer) if buffer[start:start + 2] == RPU_NAL_HEADER)
+    finally:
+        if isinstance(buffer, mmap.mmap):
+            buffer.close()
+
+class BitReader:
+    def __init__(self, data):
+        self.value = int.from_bytes(data, "big")
+        self.length = len(data) * 8
+        self.position = 0
+
+    def read(self, bits):
+        if bits == 0:
+            return 0
+        if self.position + bits > self.length:
+            raise RpuError("RPU ended in the middle of a field")
+        self.position += bits
+        return (self.value >> (self.length - self.position)) & ((1 << bits) - 1)
+
+    def flag(self):
+        return self.read(1) == 1
+
+    # Exp-Golomb codes
+    def ue(self):
+        zeros = 0
+        while not self.read(1):
+            zeros += 1
+            if zeros > 32:
+                raise RpuError("Invalid Exp-Golomb code in RPU")
+        return (1 << zeros) - 1 + self.read(zeros)
+
+    def se(self):
+        value = self.ue()
+        return (value + 1) // 2 if value % 2 else -(value // 2)
+
+    def byte_align(self):
+        self.position += -self.position % 8
+
+# Removes the emulation prevention bytes (00 00 03) from a NAL payload
+def unescape(data):
+    return bytes(data).replace(b'\x00\x00\x03', b'\x00\x00')
+
+# Same mapping dovi_tool uses to name the profile from the RPU header
+def rpu_profile(header):
+    if header["vdr_rpu_profile"] == 0:
+        return 5 if header["bl_video_full_range_flag"] else 0
+    if header["vdr_rpu_profile"] == 1:
+        if header["el_spatial_resampling_filter_flag"] and not header["disable_residual_flag"]:
+            return 7 if header["vdr_bit_depth_minus8"] == 4 else 4
+        return 8
+    return 0
+
+def read_coefficient(reader, header, signed):
+    if header["coefficient_data_type"] == 0:
+        reader.se() if signed else reader.ue()
+        reader.read(header["coefficient_log2_denom"])
+    else:
+        reader.read(32)
+
+# The reshaping curves are skipped, they only have to be read to reach the DM data behind them
+def skip_mapping(reader, header, pivots):
+    for component_pivots in pivots:
+        for _ in range(component_pivots - 1):
+            mapping_idc = reader.ue()
+            if mapping_idc == 0: # Polynomial
+                poly_order_minus1 = reader.ue()
+                if poly_order_minus1 == 0 and reader.flag():
+                    raise RpuError("RPUs with linear interpolation are not supported")
+                for _ in range(poly_order_minus1 + 2):
+                    read_coefficient(reader, header, True)
+            elif mapping_idc == 1: # MMR
+                mmr_order_minus1 = reader.read(2)
+                read_coefficient(reader, header, True)
+                for _ in range((mmr_order_minus1 + 1) * 7):
+                    read_coefficient(reader, header, True)
+            else:
+                raise RpuError(f"Unknown RPU mapping method {mapping_idc}")
+
+def skip_nlq(reader, header):
+    el_bit_depth = header["el_bit_depth_minus8"] + 8
+    for _ in range(3):
+        reader.read(el_bit_depth) # nlq_offset
+        read_coefficient(reader, header, False) # vdr_in_max
+        if header["nlq_method_idc"] == 0: # Linear dead zone: slope and threshold
+            read_coefficient(reader, header, False)
+            read_coefficient(reader, header, False)
+
+# Fills scene_refresh and the L1/L6 values of the frame from vdr_dm_data_payload
+def read_dm_data(reader, frame):
+    reader.ue() # affected_dm_metadata_id
+    reader.ue() # current_dm_metadata_id
+    frame.scene_refresh = reader.ue() == 1
+    reader.read(9 * 16 + 3 * 32 + 9 * 16) # YCC to RGB coefficients and offsets, RGB to LMS coefficients
+    reader.read(16 + 16 + 16 + 32) # signal_eotf and its parameters
+    reader.read(5 + 2 + 2 + 2) # signal bit depth, color space, chroma format, full range
+    reader.read(12 + 12 + 10) # source min/max PQ and diagonal
+    num_ext_blocks = reader.ue()
+    if num_ext_blocks:
+        reader.byte_align()
+    for _ in range(num_ext_blocks):
+        length = reader.ue()
+        level = reader.read(8)
+        block_start = reader.position
+        if level == 1:
+            frame.min_pq = reader.read(12)
+            frame.max_pq = reader.read(12)
+            frame.avg_pq = reader.read(12)
+        elif level == 6:
+            reader.read(32) # Mastering display max/min luminance
+            frame.max_cll = reader.read(16)
+            frame.max_fall = reader.read(16)
+        reader.position = block_start + length * 8
+
+# Decodes one RPU NAL unit. header carries the sequence info over to frames that don't repeat it.
+def parse_rpu(data, index, header):
+    if data[:2] != RPU_NAL_HEADER:
+        raise RpuError(f"Frame {index}: not an RPU NAL unit")
+    payload = unescape(data[2:])
+    if not payload or payload[0] != RPU_PREFIX:
+        raise RpuError(f"Frame {index}: missing RPU prefix")
+    reader = BitReader(payload[1:])
+
+    rpu_type = reader.read(6)
+    rpu_format = reader.read(11)
+    if rpu_type != 2:
+        raise RpuError(f"Frame {index}: unsupported RPU type {rpu_type}")
+    header["vdr_rpu_profile"] = reader.read(4)
+    reader.read(4) # vdr_rpu_level
+    if reader.flag(): # vdr_seq_info_present_flag
+        reader.flag() # chroma_resampling_explicit_filter_flag
+        header["coefficient_data_type"] = reader.read(2)
+        if header["coefficient_data_type"] == 0:
+            header["coefficient_log2_denom"] = reader.ue()
+        reader.read(2) # vdr_rpu_normalized_idc
+        header["bl_video_full_range_flag"] = reader.flag()
+        # Bit depths are only coded for formats with a base layer mapping; 10-bit BL, 12-bit VDR otherwise
+        header.update(bl_bit_depth_minus8=2, el_bit_depth_minus8=2, vdr_bit_depth_minus8=4,
+                      el_spatial_resampling_filter_flag=False, disable_residual_flag=True)
+        if rpu_format & 0x700 == 0:
+            header["bl_bit_depth_minus8"] = reader.ue()
+            header["el_bit_depth_minus8"] = reader.ue()
+            header["vdr_bit_depth_minus8"] = reader.ue()
+            reader.flag() # spatial_resampling_filter_flag
+            reader.read(3) # reserved_zero_3bits
+            header["el_spatial_resampling_filter_flag"] = reader.flag()
+            header["disable_residual_flag"] = reader.flag()
+    elif "coefficient_data_type" not in header:
+        raise RpuError(f"Frame {index}: RPU has no sequence info")
+
+    dm_metadata_present = reader.flag()
+    if reader.flag(): # use_prev_vdr_rpu_flag, no mapping in this frame
+        reader.ue() # prev_vdr_rpu_id
+    else:
+        reader.ue() # vdr_rpu_id
+        reader.ue() # mapping_color_space
+        reader.ue() # mapping_chroma_format_idc
+        pivots = []
+        for _ in range(3):
+            num_pivots = reader.ue() + 2
+            reader.read(num_pivots * (header["bl_bit_depth_minus8"] + 8))
+            pivots.append(num_pivots)
+        nlq = rpu_format & 0x700 == 0 and not header["disable_residual_flag"]
+        if nlq:
+            header["nlq_method_idc"] = reader.read(3)
+        reader.ue() # num_x_partitions_minus1
+        reader.ue() # num_y_partitions_minus1
+        skip_mapping(reader, header, pivots)
+        if nlq:
+            skip_nlq(reader, header)
+
+    frame = RpuFrame(index=index, profile=rpu_profile(header))
+    if dm_metadata_present:
+        read_dm_data(reader, frame)
+    return frame
+
+# Frame count, profile and per-frame L1/L6 summary of an RPU .bin
+def read_rpu_file(path, keep_frames=False):
+    buffer = open_rpu_file(path)
+    info = RpuInfo(path=path, frame_count=0)
+    header = {}
+    try:
+        for start, end in iter_nal_units(buffer):
+            frame = parse_rpu(buffer[start:end], info.frame_count, header)
+            info.frame_count += 1
+            info.profile = info.profile or frame.profile
+            info.scene_count += frame.scene_refresh
+            if frame.max_pq is not None:
+                info.max_pq = max(info.max_pq or 0, frame.max_pq)
+                info.max_avg_pq = max(info.max_avg_pq or 0, frame.avg_pq)
+            if frame.max_cll is not None:
+                info.max_cll, info.max_fall = frame.max_cll, frame.max_fall
+            if keep_frames:
+                info.frames.append(frame)
+    finally:
+        if isinstance(buffer, mmap.mmap):
+            buffer.close()
+    return info
+
+# Profile of the first RPU of the file, which every RPU of a stream shares
+def read_rpu_profile(path):
+    buffer = open_rpu_file(path)
+    try:
+        for start, end in iter_nal_units(buffer):
+            return parse_rpu(buffer[start:end], 0, {}).profile
+    finally:
+        if isinstance(buffer, mmap.mmap):
+            buffer.close()
+    raise RpuError("RPU file has no frames")
+
+# Raises unless the source's DoVi profile converts and the extracted RPU came out as the profile
+# the output needs; source_profile is the container's, None when it has no configuration record
+def validate_profile(rpu_profile, source_profile=None):
+    if source_profile is not None and source_profile not in CONVERTIBLE_PROFILES:
+        raise RpuError(f"Dolby Vision profile {source_profile} sources can't be converted, only profile 7 and 8")
+    if rpu_profile != OUTPUT_PROFILE:
+        raise RpuError(f"RPU is profile {rpu_profile} after conversion, the re-encoded video needs profile {OUTPUT_PROFILE}")
+    return rpu_profile
+
+# Raises if the RPU doesn't have exactly one entry per encoded frame, which inject-rpu would
+# otherwise turn into a desynced or truncated output
+def validate_frame_alignment(rpu_file, expected_frames):
+    rpu_frames = count_rpu_frames(rpu_file)
+    if rpu_frames != expected_frames:
+        raise RpuError(f"RPU has {rpu_frames} frames but the encoded video has {expected_frames}, the metadata would be out of sync")
+    return rpu_frames
@@ -1,206 +1,17 @@
 import os
-import re
-import subprocess
-import shutil
 import threading
 import webbrowser
-import json
+import time
 from tkinter import Tk, filedialog, messagebox, Label, Button, Entry, StringVar, DoubleVar, OptionMenu, IntVar
 from tkinter import ttk
 
-# Define paths to the tools in the "tools" folder
-tools_dir = os.path.join(os.path.dirname(__file__), "tools")
-dovi_tool_path = os.path.join(tools_dir, "dovi_tool.exe")
-ffmpeg_path = os.path.join(tools_dir, "ffmpeg.exe")
-mkvmerge_path = os.path.join(tools_dir, "mkvmerge.exe")
-
-# Configuration file path
-config_file = os.path.join(os.path.dirname(__file__), "config.json")
-
-# Global variable to track if the process should be aborted
-abort_process = False
-
-# Load settings from the configuration file
-def load_settings():
-    if os.path.exists(config_file):
-        with open(config_file, "r") as f:
-            return json.load(f)
-    return {}
-
-# Save settings to the configuration file
-def save_settings(settings):
-    with open(config_file, "w") as f:
-        json.dump(settings, f)
-
-def extract_hevc_stream(input_file, hevc_file):
-    command = [
-        ffmpeg_path,
-        '-hwaccel', 'cuda',
-        '-hwaccel_output_format', 'cuda',
-        '-c:v', 'hevc_cuvid',
-        '-i', input_file,
-        '-c:v', 'copy',
-        '-an', '-sn', '-dn',
-        hevc_file
-    ]
-    subprocess.run(command, check=True, creationflags=subprocess.CREATE_NO_WINDOW)
-
-def extract_dovi_metadata(hevc_file, metadata_file):
-    # Use -m 4 for RPU extraction
-    command = [
-        dovi_tool_path,
-        '-m', '4',
-        'extract-rpu',
-        '-i', hevc_file,
-        '-o', metadata_file
-    ]
-    result = subprocess.run(command, capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
-
-    # Check if RPU was found
-    if "Found no RPU" in result.stderr:
-        raise ValueError("No Dolby Vision metadata found in the source file")
-
-    subprocess.run(command, check=True, creationflags=subprocess.CREATE_NO_WINDOW)
-
-def reencode_video(input_file, output_file, quality, encoding_mode, encoding_quality_preset, progress_callback):
-    cmd_duration = [ffmpeg_path, '-i', input_file]
-    result = subprocess.run(cmd_duration, stderr=subprocess.PIPE, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
-    duration_match = re.search(r"Duration: (\d{2}:\d{2}:\d{2}\.\d{2})", result.stderr)
-    total_duration = 0
-    if duration_match:
-        time_str = duration_match.group(1)
-        hours, minutes, seconds = map(float, time_str.split(':'))
-        total_duration = hours * 3600 + minutes * 60 + seconds
-
-    if encoding_mode == "CUDA":
-        cmd = [
-            ffmpeg_path,
-            '-hwaccel', 'cuda',
-            '-hwaccel_output_format', 'cuda',
-            '-c:v', 'hevc_cuvid',
-            '-i', input_file,
-            '-c:v', 'hevc_nvenc',
-            '-preset', encoding_quality_preset,
-            '-tune', 'hq',
-            '-rc', 'vbr',
-            '-cq', str(quality),
-            '-b:v', '0',
-            '-c:a', 'copy',
-            '-y', output_file
-        ]
-    elif encoding_mode == "QSV":
-        cmd = [
-            ffmpeg_path,
-            '-init_hw_device', 'qsv=hw',  # Initialize QSV device
-            '-filter_hw_device', 'hw',
-            '-hwaccel', 'qsv',
-            '-hwaccel_output_format', 'qsv',
-            '-c:v', 'hevc_qsv',  # Use QSV for decoding
-            '-i', input_file,
-            '-c:v', 'hevc_qsv',  # Use QSV for encoding
-            '-preset', encoding_quality_preset,
-            '-global_quality', str(quality),  # Correct parameter for QSV
-            '-c:a', 'copy',
-            '-y', output_file
-        ]
-    else:
-        cmd = [
-            ffmpeg_path,
-            '-i', input_file,
-            '-c:v', 'libx265',
-            '-crf', str(quality),
-            '-preset', encoding_quality_preset, # Using preset here for CPU as well
-            '-c:a', 'copy',
-            '-y', output_file
-        ]
-
-    process = subprocess.Popen(cmd, stderr=subprocess.PIPE, universal_newlines=True, creationflags=subprocess.CREATE_NO_WINDOW)
-    while True:
-        if abort_process:
-            process.terminate()
-            break
-        line = process.stderr.readline()
-        if not line:
-            break
-        if 'time=' in line:
-            time_match = re.search(r'time=(\d{2}:\d{2}:\d{2}\.\d{2})', line)
-            if time_match and total_duration > 0:
-                current_time = time_match.group(1)
-                hours, minutes, seconds = map(float, current_time.split(':'))
-                current_seconds = hours * 3600 + minutes * 60 + seconds
-                progress = (current_seconds / total_duration) * 100
-                progress_callback(progress)
-    process.wait()
-
-def transcode_audio(input_file, output_file, channels, bitrate):
-    if channels == "No":
-        return input_file
-    channel_map = {"2.0 Stereo": "2", "5.1 Surround": "6", "7.1 Surround": "8"}
-    command = [
-        ffmpeg_path,
-        '-i', input_file,
-        '-map', '0:a',
-        '-c:a', 'aac',
-        '-b:a', bitrate,
-        '-ac', channel_map[channels],
-        output_file
-    ]
-    subprocess.run(command, check=True, creationflags=subprocess.CREATE_NO_WINDOW)
-    return output_file
-
-def inject_dovi_metadata(video_file, metadata_file, output_file):
-    command = [
-        dovi_tool_path,
-        '-m', '4',
-        'inject-rpu',
-        '-i', video_file,
-        '--rpu-in', metadata_file,
-        '-o', output_file
-    ]
-    subprocess.run(command, check=True, creationflags=subprocess.CREATE_NO_WINDOW)
-
-def remux_video(video_file, audio_file, original_file, output_file, keep_original_audio):
-    if audio_file == original_file:
-        if keep_original_audio == "Keep":
-            command = [
-                mkvmerge_path,
-                '-o', output_file,
-                video_file,
-                '--no-video', original_file,
-                '--no-track-tags',
-                '--no-global-tags'
-            ]
-        else:
-            command = [
-                mkvmerge_path,
-                '-o', output_file,
-                video_file,
-                '--no-audio',
-                '--no-track-tags',
-                '--no-global-tags'
-            ]
-    else:
-        if keep_original_audio == "Keep":
-            command = [
-                mkvmerge_path,
-                '-o', output_file,
-                video_file,
-                audio_file,
-                '--no-video', original_file,
-                '--no-track-tags',
-                '--no-global-tags'
-            ]
-        else:
-            command = [
-                mkvmerge_path,
-                '-o', output_file,
-                video_file,
-                audio_file,
-                '--no-audio',
-                '--no-track-tags',
-                '--no-global-tags'
-            ]
-    subprocess.run(command, check=True, creationflags=subprocess.CREATE_NO_WINDOW)
+from redovi_engine import (
+    DEFAULT_CPU_SEGMENTS, DEFAULT_PARALLEL_FILES, DEFAULT_SLOT_LIMITS, PIPELINE_MODES, QUALITY_PRESETS,
+    load_settings, save_settings, find_video_files, format_size, format_progress_stats, process_video_file, enqueue_jobs, run_job_queue,
+    request_abort, reset_abort, abort_requested
+)
+
+PROGRESS_REFRESH_MS = 250 # How often queued progress updates are drawn
 
 class App:
     def __init__(self, root):
@@ -220,14 +31,18 @@ class App:
         self.audio_bitrate_var = StringVar(value=self.settings.get("audio_bitrate", "640k"))
         self.keep_original_audio_var = StringVar(value=self.settings.get("keep_original_audio", "Keep"))
         self.encoding_quality_var = StringVar(value=self.settings.get("encoding_quality", "slow"))
+        self.pipeline_mode_var = StringVar(value=self.settings.get("pipeline_mode", "Temp Files"))
+        self.failed_temp_var = StringVar(value=self.settings.get("failed_temp", "Keep Temp"))
+        self.cpu_segments_var = IntVar(value=self.settings.get("cpu_segments", DEFAULT_CPU_SEGMENTS))
+        self.parallel_files_var = IntVar(value=self.settings.get("parallel_files", DEFAULT_PARALLEL_FILES))
         self.is_folder_input = False # Track if folder input is selected
+        self.file_progress = {} # Progress of every file in the current run
+        self.is_batch_run = False
+        self.pending_progress = {} # Latest progress event per file, waiting for the next GUI refresh
+        self.progress_lock = threading.Lock()
 
         # Define quality presets for each encoding mode
-        self.quality_presets = {
-            "CUDA": ["slow", "medium", "fast", "hp", "hq"], # Added more CUDA presets
-            "QSV": ["slow", "medium", "fast", "faster", "veryfast"], # Added more QSV presets
-            "CPU": ["ultrafast", "faster", "fast", "medium", "slow", "veryslow", "slower", "placebo"] # Added more CPU presets
-        }
+        self.quality_presets = QUALITY_PRESETS
         # Make sure default preset is valid, if not, set to first available
         default_preset = self.settings.get("encoding_quality", "medium")
         if default_preset not in self.quality_presets.get(self.settings.get("encoding_mode", "CUDA"), ["slow", "medium", "fast"]): # Default fallback if no mode or preset is saved, use original defaults.
@@ -266,6 +81,9 @@ class App:
         Label(self.root, text="Quality (16-40):").grid(row=4, column=0, padx=5, pady=5)
         ttk.Combobox(self.root, textvariable=self.quality_var, values=list(range(16, 41)), width=7).grid(row=4, column=1, padx=5, pady=5)
 
+        Label(self.root, text="Parallel Files:").grid(row=4, column=2, padx=5, pady=5)
+        ttk.Combobox(self.root, textvariable=self.parallel_files_var, values=list(range(1, 9)), width=7).grid(row=4, column=3, padx=5, pady=5)
+
         # Audio
         Label(self.root, text="Convert Audio:").grid(row=5, column=0, padx=5, pady=5)
         OptionMenu(self.root, self.audio_channels_var, *["No", "2.0 Stereo", "5.1 Surround", "7.1 Surround"]).grid(row=5, column=1, padx=5, pady=5)
@@ -273,6 +91,8 @@ class App:
         OptionMenu(self.root, self.audio_bitrate_var, *["128k", "192k", "256k", "384k", "480k", "640k"]).grid(row=6, column=1, padx=5, pady=5)
         Label(self.root, text="Keep Original Audio:").grid(row=5, column=2, padx=5, pady=5)
         OptionMenu(self.root, self.keep_original_audio_var, *["Keep", "Remove"]).grid(row=5, column=3, padx=5, pady=5)
+        Label(self.root, text="Pipeline Mode:").grid(row=6, column=2, padx=5, pady=5)
+        OptionMenu(self.root, self.pipeline_mode_var, *PIPELINE_MODES).grid(row=6, column=3, padx=5, pady=5)
 
         # Encoding
         Label(self.root, text="Encoding Mode:").grid(row=7, column=0, padx=5, pady=5)
@@ -286,27 +106,33 @@ class App:
 
         # Progress
         self.progress_text_var = StringVar(value="Waiting to start...")
-        Label(self.root, textvariable=self.progress_text_var).grid(row=8, column=0, columnspan=4, padx=5, pady=5)
+        # Temp files of failed or aborted jobs are kept by default so a re-run resumes where it stopped
+        Label(self.root, text="Failed Jobs:").grid(row=8, column=0, padx=5, pady=5)
+        OptionMenu(self.root, self.failed_temp_var, *["Keep Temp", "Delete Temp"]).grid(row=8, column=1, padx=5, pady=5)
+        Label(self.root, text="CPU Segments:").grid(row=8, column=2, padx=5, pady=5)
+        ttk.Combobox(self.root, textvariable=self.cpu_segments_var, values=[1, 2, 4, 6, 8, 12, 16], width=7).grid(row=8, column=3, padx=5, pady=5)
+
+        Label(self.root, textvariable=self.progress_text_var).grid(row=9, column=0, columnspan=4, padx=5, pady=5)
         self.progress_bar = ttk.Progressbar(self.root, variable=self.progress_value_var, maximum=100)
-        self.progress_bar.grid(row=9, column=0, columnspan=4, padx=5, pady=5, sticky='we')
+        self.progress_bar.grid(row=10, column=0, columnspan=4, padx=5, pady=5, sticky='we')
 
         # Buttons
         self.process_button = Button(self.root, text="Process Video", command=self.start_processing)
-        self.process_button.grid(row=10, column=1, padx=5, pady=20)
+        self.process_button.grid(row=11, column=1, padx=5, pady=20)
         self.abort_button = Button(self.root, text="Abort", command=self.abort_processing, state='disabled')
-        self.abort_button.grid(row=10, column=2, padx=5, pady=20)
+        self.abort_button.grid(row=11, column=2, padx=5, pady=20)
 
         # Support Button
-        Button(self.root, text="Support This Project", command=self.open_donation_link, bg="lightblue").grid(row=11, column=3, padx=10, pady=10, sticky="se")
+        Button(self.root, text="Support This Project", command=self.open_donation_link, bg="lightblue").grid(row=12, column=3, padx=10, pady=10, sticky="se")
 
         # Credits
         credit = Label(self.root, text="Special thanks to quietvoid", fg="blue", cursor="hand2", font=("Arial", 8))
-        credit.grid(row=11, column=0, padx=10, pady=10, sticky="sw")
+        credit.grid(row=12, column=0, padx=10, pady=10, sticky="sw")
         credit.bind("<Button-1>", lambda e: webbrowser.open("https://github.com/quietvoid/dovi_tool"))
 
         # Bottom Text
-        bottom_text = "A temp folder will be created in the Output Folder. \nAround four files the size of the transcoded file \nwill be created and deleted when the process \nis complete"
-        Label(self.root, text=bottom_text, font=("Arial", 8), justify='center').grid(row=12, column=0, columnspan=4, pady=10)
+        bottom_text = "A temp folder will be created in the Output Folder. \nThree files the size of the transcoded file, plus the \ndemuxed source outside Streamed mode, will be created \nand deleted when the process is complete"
+        Label(self.root, text=bottom_text, font=("Arial", 8), justify='center').grid(row=13, column=0, columnspan=4, pady=10)
 
 
     def update_quality_presets(self, *args):
@@ -379,14 +205,79 @@ class App:
     def update_progress(self, value, text):
         self.progress_text_var.set(text)
         self.progress_value_var.set(value)
-        self.root.update_idletasks()
+
+    # Progress of a single file; while a folder is processed the bar shows the whole batch
+    def report_progress(self, input_file, value, text):
+        # Stages run concurrently, so a file's progress only ever moves forward
+        self.file_progress[input_file] = max(value, self.file_progress.get(input_file, 0))
+        overall = sum(self.file_progress.values()) / len(self.file_progress)
+        if len(self.file_progress) > 1:
+            text = f"{os.path.basename(input_file)}: {text}"
+        self.update_progress(overall, text)
+
+    def flush_progress(self):
+        with self.progress_lock:
+            events, self.pending_progress = self.pending_progress, {}
+        for event in events.values():
+            text = event["message"]
+            stats = format_progress_stats(event)
+            if stats:
+                text = f"{text} {stats}"
+            self.report_progress(event["file"], event["percent"], text)
+
+    # Called by the engine from its worker threads; everything that touches Tk goes through root.after
+    def handle_event(self, event):
+        kind = event["event"]
+        if kind == "progress":
+            # Only the newest update per file is kept; one refresh is scheduled per PROGRESS_REFRESH_MS
+            with self.progress_lock:
+                schedule = not self.pending_progress
+                self.pending_progress[event["file"]] = event
+            if schedule:
+                self.root.after(PROGRESS_REFRESH_MS, self.flush_progress)
+        elif kind == "file_failed":
+            if self.is_batch_run:
+                self.root.after(0, lambda: messagebox.showerror("Error", f"Error processing {os.path.basename(event['file'])}: {event['error']}"))
+            else:
+                self.root.after(0, lambda: messagebox.showerror("Error", f"Process failed: {event['error']}"))
+        elif kind == "file_done" and not self.is_batch_run:
+            summary = f"{time.strftime('%H:%M:%S', time.gmtime(event['seconds']))}, peak temp {format_size(event['peak_temp_bytes'])}"
+            self.root.after(0, lambda: messagebox.showinfo("Success", f"Process completed successfully!\n{summary}\nSupport Your Devs!"))
+        elif kind == "job_retry":
+            self.root.after(0, lambda: self.report_progress(event["file"], 0, f"Failed, retrying in {event['retry_in']}s"))
+        elif kind == "file_cached":
+            self.root.after(0, lambda: self.report_progress(event["file"], 100, "Reused an identical earlier encode"))
+            if not self.is_batch_run:
+                self.root.after(0, lambda: messagebox.showinfo("Success", f"Already encoded with the same settings, reused:\n{event['cached_output']}"))
+
+    # The GUI settings in the form the engine and config.json use
+    def current_options(self):
+        return {
+            "quality": self.quality_var.get(),
+            "audio_channels": self.audio_channels_var.get(),
+            "encoding_mode": self.encoding_mode_var.get(),
+            "audio_bitrate": self.audio_bitrate_var.get(),
+            "keep_original_audio": self.keep_original_audio_var.get(),
+            "encoding_quality": self.encoding_quality_var.get(),
+            "pipeline_mode": self.pipeline_mode_var.get(),
+            "failed_temp": self.failed_temp_var.get(),
+            "cpu_segments": self.cpu_segments_var.get(),
+            "parallel_files": self.parallel_files_var.get(),
+            "slot_limits": self.settings.get("slot_limits", DEFAULT_SLOT_LIMITS),
+            "output_cache": self.settings.get("output_cache", "Reuse"),
+            "output_cache_limit_gb": self.settings.get("output_cache_limit_gb", 0),
+            "scratch_folder": self.settings.get("scratch_folder", ""),
+            "auto_quality": self.settings.get("auto_quality", "Off"),
+            "target_size_gb": self.settings.get("target_size_gb", 20),
+            "target_vmaf": self.settings.get("target_vmaf", 93),
+            "encode_profile": self.settings.get("encode_profile", "Standard")
+        }
 
     def open_donation_link(self):
         webbrowser.open("https://www.paypal.com/donate/?hosted_button_id=A38KG42PKBBBY")
 
     def start_processing(self):
-        global abort_process
-        abort_process = False  # Reset abort flag
+        reset_abort()  # Reset abort flag
 
         input_path = self.input_file_var.get() # Get input path which can be file or folder
         output_folder = self.output_folder_var.get()
@@ -407,34 +298,44 @@ class App:
             messagebox.showerror("Error", "Invalid quality value")
             return
 
+        try:
+            if self.cpu_segments_var.get() < 1 or self.parallel_files_var.get() < 1:
+                messagebox.showerror("Error", "CPU Segments and Parallel Files must be at least 1")
+                return
+        except ValueError:
+            messagebox.showerror("Error", "Invalid CPU Segments or Parallel Files value")
+            return
+
+        self.file_progress = {}
+        self.is_batch_run = self.is_folder_input
+        options = self.current_options() # Read the Tk variables here, not on the worker thread
+
         self.process_button.config(state='disabled')
         self.abort_button.config(state='normal')
 
         if self.is_folder_input:
             threading.Thread(
                 target=self.process_folder, # Call process_folder if folder input
-                args=(input_path, output_folder),
+                args=(input_path, output_folder, options),
                 daemon=True
             ).start()
         else:
             threading.Thread(
                 target=self.process_video, # Call process_video for single file
-                args=(input_path, output_folder),
+                args=(input_path, output_folder, options),
                 daemon=True
             ).start()
 
 
     def abort_processing(self):
-        global abort_process
-        abort_process = True
+        request_abort()
         self.process_button.config(state='normal')
         self.abort_button.config(state='disabled')
         messagebox.showinfo("Abort", "Process aborted.")
 
-    def process_folder(self, input_folder, output_folder):
+    def process_folder(self, input_folder, output_folder, options):
      
-     video_extensions = ('.mkv', '.mp4')
-     files_to_process = [f for f in os.listdir(input_folder) if f.lower().endswith(video_extensions)]
+     files_to_process = find_video_files(input_folder, recursive=True) # Show/season subfolders too
 
      
      if not files_to_process:
@@ -443,127 +344,41 @@ class App:
          self.root.after(0, lambda: self.abort_button.config(state='disabled'))
          return # This return is CORRECT and should stay
 
-     processed_count = 0
-     total_files = len(files_to_process)
-
-     for filename in files_to_process:
-         if abort_process:
-             break
+     # Same keys as the job sources in the engine's events, whatever separators the dialog returned
+     self.file_progress = {os.path.abspath(f): 0 for f in files_to_process}
+     # The files join the job queue on disk with the current settings, so a restart or a crash
+     # doesn't lose them; jobs left over from an earlier session are worked through as well.
+     # Files go next to their source unless an output folder was chosen.
+     enqueue_jobs(files_to_process, output_folder, options)
+     processed_count, failed_count = run_job_queue(options, self.handle_event)
 
-         input_file_path = os.path.join(input_folder, filename)
-         current_output_folder = output_folder if output_folder else input_folder
-
-         try:
-             # Bind current filename and processed_count to the lambda
-             self.root.after(0, lambda f=filename, pc=processed_count: self.update_progress(0, f"Processing file {pc + 1}/{total_files}: {f}"))
-             self.process_video_file(input_file_path, current_output_folder)
-             processed_count += 1
-         except Exception as e:
-             error_msg = str(e)
-             self.root.after(0, lambda msg=error_msg, f=filename: messagebox.showerror("Error", f"Error processing {f}: {msg}"))
-
-     if abort_process:
-         self.root.after(0, lambda: messagebox.showinfo("Abort", "Folder process aborted by user."))
+     if abort_requested():
+         self.root.after(0, lambda: messagebox.showinfo("Abort", "Folder process aborted by user. The unfinished files stay queued for the next run."))
      else:
-         self.root.after(0, lambda: messagebox.showinfo("Success", f"Processed {processed_count} of {total_files} files successfully!\nSupport Your Devs!"))
+         self.root.after(0, lambda: messagebox.showinfo("Success", f"Processed {processed_count} of {processed_count + failed_count} queued files successfully!\nSupport Your Devs!"))
 
      self.root.after(0, lambda: self.process_button.config(state='normal'))
      self.root.after(0, lambda: self.abort_button.config(state='disabled'))
 
 
-    def process_video(self, input_file, output_folder): # Renamed to process_video_file and this function will be folder/single dispatch
+    def process_video(self, input_file, output_folder, options): # Single file; process_folder handles folder input
         if output_folder is None: # Default output to same folder as input file
             current_output_folder = os.path.dirname(input_file)
         else:
             current_output_folder = output_folder
 
-        self.process_video_file(input_file, current_output_folder) # Call actual file processing
-
-
-    def process_video_file(self, input_file, output_folder): # Actual file processing logic (formerly process_video)
-        global abort_process
-        temp_folder = os.path.join(output_folder, "temp")
-        os.makedirs(temp_folder, exist_ok=True)
-
+        self.file_progress = {input_file: 0}
         try:
-            base_name = os.path.splitext(os.path.basename(input_file))[0]
-            paths = {
-                'hevc': os.path.join(temp_folder, f"{base_name}_temp.hevc"),
-                'metadata': os.path.join(temp_folder, f"{base_name}_rpu.bin"),
-                'reencoded': os.path.join(temp_folder, f"{base_name}_reencoded.mkv"),
-                'reencoded_hevc': os.path.join(temp_folder, f"{base_name}_reencoded.hevc"),
-                'final_hevc': os.path.join(temp_folder, f"{base_name}_final.hevc"),
-                'audio': os.path.join(temp_folder, f"{base_name}_audio.aac"),
-                'output': os.path.join(output_folder, f"{base_name}_ReDoVi.mkv")
-            }
-
-            self.root.after(0, lambda: self.update_progress(0, "Demuxing DoVi RPU..."))
-            extract_hevc_stream(input_file, paths['hevc'])
-
-            self.root.after(0, lambda: self.update_progress(10, "Extracting metadata..."))
-            try:
-                extract_dovi_metadata(paths['hevc'], paths['metadata'])
-            except ValueError as e:
-                self.root.after(0, lambda: messagebox.showerror("Error", str(e)))
-                raise e # Re-raise to be caught in folder processing loop
-
-            self.root.after(0, lambda: self.update_progress(20, "Transcoding video..."))
-            reencode_video(
-                input_file,
-                paths['reencoded'],
-                self.quality_var.get(),
-                self.encoding_mode_var.get(),
-                self.encoding_quality_var.get(),
-                lambda p: self.root.after(0, lambda: self.update_progress(20 + p * 0.8, "Transcoding..."))
-            )
-
-            if abort_process:
-                raise Exception("Process aborted by user")
-
-            self.root.after(0, lambda: self.update_progress(90, "Extracting HEVC..."))
-            extract_hevc_stream(paths['reencoded'], paths['reencoded_hevc'])
-
-            self.root.after(0, lambda: self.update_progress(95, "Injecting metadata..."))
-            inject_dovi_metadata(paths['reencoded_hevc'], paths['metadata'], paths['final_hevc'])
-
-            self.root.after(0, lambda: self.update_progress(97, "Processing audio..."))
-            audio_file = transcode_audio(
-                input_file,
-                paths['audio'],
-                self.audio_channels_var.get(),
-                self.audio_bitrate_var.get()
-            )
-
-            self.root.after(0, lambda: self.update_progress(98, "Remuxing..."))
-            remux_video(
-                paths['final_hevc'],
-                audio_file,
-                input_file,
-                paths['output'],
-                self.keep_original_audio_var.get()
-            )
-
-            self.root.after(0, lambda: messagebox.showinfo("Success", "Process completed successfully!\nSupport Your Devs!"))
-        except Exception as e:
-            error_msg = str(e)
-            self.root.after(0, lambda: messagebox.showerror("Error", f"Process failed: {error_msg}"))
-            raise e # Re-raise to be caught in folder processing loop
-        finally:
-            if os.path.exists(temp_folder):
-                shutil.rmtree(temp_folder) # Cleanup temp folder after each file processing
+            process_video_file(input_file, current_output_folder, options, self.handle_event)
+        except Exception:
+            pass # Already shown through the file_failed event
+        self.root.after(0, lambda: self.process_button.config(state='normal'))
+        self.root.after(0, lambda: self.abort_button.config(state='disabled'))
 
 
     def on_close(self):
         # Save settings before closing
-        settings = {
-            "quality": self.quality_var.get(),
-            "audio_channels": self.audio_channels_var.get(),
-            "encoding_mode": self.encoding_mode_var.get(),
-            "audio_bitrate": self.audio_bitrate_var.get(),
-            "keep_original_audio": self.keep_original_audio_var.get(),
-            "encoding_quality": self.encoding_quality_var.get()
-        }
-        save_settings(settings)
+        save_settings(self.current_options())
         self.root.destroy()
 
 if __name__ == "__main__":
@@ -0,0 +1,176 @@
+import os
+
+# Writes the RPU .bin fixtures the way "dovi_tool extract-rpu" lays them out: one UNSPEC62 NAL
+# unit per frame behind a 4-byte start code, the 0x19 prefix, the RPU bits, the CRC-32/MPEG-2 of
+# the RPU and the 0x80 end byte, with emulation prevention bytes inserted. The values are those of
+# a Blu-ray profile 8.1 stream and a profile 7 FEL one; tests/test_rpu.py checks them.
+#   python tests/fixtures/make_rpu_fixtures.py
+
+FIXTURES = os.path.dirname(os.path.abspath(__file__))
+COEFFICIENT_LOG2_DENOM = 23
+
+class BitWriter:
+    def __init__(self):
+        self.bits = []
+
+    def u(self, bits, value):
+        self.bits += [(value >> (bits - 1 - i)) & 1 for i in range(bits)]
+
+    def flag(self, value):
+        self.u(1, int(value))
+
+    def ue(self, value):
+        length = (value + 1).bit_length()
+        self.u(length - 1, 0)
+        self.u(length, value + 1)
+
+    def se(self, value):
+        self.ue(2 * value - 1 if value > 0 else -2 * value)
+
+    def align(self):
+        while len(self.bits) % 8:
+            self.bits.append(0)
+
+    def to_bytes(self):
+        self.align()
+        return bytes(int("".join(map(str, self.bits[i:i + 8])), 2) for i in range(0, len(self.bits), 8))
+
+def crc32_mpeg2(data):
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+            crc &= 0xFFFFFFFF
+    return crc
+
+def escape(data):
+    out = bytearray()
+    zeros = 0
+    for byte in data:
+        if zeros >= 2 and byte <= 3:
+            out.append(3)
+            zeros = 0
+        out.append(byte)
+        zeros = zeros + 1 if byte == 0 else 0
+    return bytes(out)
+
+def coefficient(w, value, signed=True):
+    integer = int(value // 1)
+    w.se(integer) if signed else w.ue(integer)
+    w.u(COEFFICIENT_LOG2_DENOM, int((value - integer) * (1 << COEFFICIENT_LOG2_DENOM)))
+
+def write_header(w, fel, seq_info=True, use_prev=False):
+    w.u(6, 2) # rpu_type
+    w.u(11, 18) # rpu_format; no 0x700 bits, so the bit depths are coded
+    w.u(4, 1) # vdr_rpu_profile
+    w.u(4, 0) # vdr_rpu_level
+    w.flag(seq_info)
+    if seq_info:
+        w.flag(0) # chroma_resampling_explicit_filter_flag
+        w.u(2, 0) # coefficient_data_type
+        w.ue(COEFFICIENT_LOG2_DENOM)
+        w.u(2, 1) # vdr_rpu_normalized_idc
+        w.flag(0) # bl_video_full_range_flag
+        w.ue(2) # bl_bit_depth_minus8
+        w.ue(2) # el_bit_depth_minus8
+        w.ue(4) # vdr_bit_depth_minus8
+        w.flag(0) # spatial_resampling_filter_flag
+        w.u(3, 0) # reserved_zero_3bits
+        w.flag(fel) # el_spatial_resampling_filter_flag
+        w.flag(not fel) # disable_residual_flag
+    w.flag(1) # vdr_dm_metadata_present_flag
+    w.flag(use_prev)
+    if use_prev:
+        w.ue(0) # prev_vdr_rpu_id
+        return
+    w.ue(0) # vdr_rpu_id
+    w.ue(0) # mapping_color_space
+    w.ue(0) # mapping_chroma_format_idc
+    pivots = [[0, 128, 1023], [0, 1023], [0, 1023]]
+    for component in pivots:
+        w.ue(len(component) - 2) # num_pivots_minus_2
+        w.u(10, component[0])
+        for previous, pivot in zip(component, component[1:]):
+            w.u(10, pivot - previous)
+    if fel:
+        w.u(3, 0) # nlq_method_idc, linear dead zone
+    w.ue(0) # num_x_partitions_minus1
+    w.ue(0) # num_y_partitions_minus1
+
+    # Luma: two second order polynomials; chroma: third order MMR
+    for poly in ([0.0, 1.0, -0.015625], [0.0078125, 0.96875, 0.03125]):
+        w.ue(0) # mapping_idc, polynomial
+        w.ue(len(poly) - 2) # poly_order_minus1
+        for value in poly:
+            coefficient(w, value)
+    for _ in range(2):
+        w.ue(1) # mapping_idc, MMR
+        w.u(2, 2) # mmr_order_minus1
+        coefficient(w, 0.5) # mmr_constant
+        for order in range(3):
+            for i in range(7):
+                coefficient(w, (-1) ** i * (order + 1) / 64)
+    if fel:
+        for _ in range(3):
+            w.u(10, 512) # nlq_offset
+            coefficient(w, 1.0, signed=False) # vdr_in_max
+            coefficient(w, 0.25, signed=False) # linear_deadzone_slope
+            coefficient(w, 0.0, signed=False) # linear_deadzone_threshold
+
+def write_dm_data(w, scene_refresh, l1, l6):
+    w.ue(0) # affected_dm_metadata_id
+    w.ue(0) # current_dm_metadata_id
+    w.ue(int(scene_refresh))
+    for value in (8192, 0, 12900, 8192, -1534, -3836, 8192, 15201, 0): # ycc_to_rgb_coef, BT.2020 limited
+        w.u(16, value & 0xFFFF)
+    for value in (16777216, 134217728, 134217728): # ycc_to_rgb_offset
+        w.u(32, value)
+    for value in (7222, 8771, 390, 2654, 12430, 1300, 0, 422, 15962): # rgb_to_lms_coef
+        w.u(16, value)
+    w.u(16, 65535) # signal_eotf, PQ
+    w.u(16, 0) # signal_eotf_param0
+    w.u(16, 0) # signal_eotf_param1
+    w.u(32, 0) # signal_eotf_param2
+    w.u(5, 12) # signal_bit_depth
+    w.u(2, 0) # signal_color_space
+    w.u(2, 0) # signal_chroma_format
+    w.u(2, 1) # signal_full_range_flag
+    w.u(12, 62) # source_min_pq
+    w.u(12, 3696) # source_max_pq
+    w.u(10, 42) # source_diagonal
+    w.ue(2) # num_ext_blocks
+    w.align()
+    w.ue(5) # ext_block_length
+    w.u(8, 1)
+    for value in l1: # min_pq, max_pq, avg_pq
+        w.u(12, value)
+    w.u(4, 0) # ext_dm_alignment_zero_bit
+    w.ue(8)
+    w.u(8, 6)
+    for value in (1000, 50) + l6: # mastering max/min luminance, max_cll, max_fall
+        w.u(16, value)
+
+def rpu_nal(fel, scene_refresh, l1, l6, seq_info=True, use_prev=False):
+    w = BitWriter()
+    write_header(w, fel, seq_info, use_prev)
+    write_dm_data(w, scene_refresh, l1, l6)
+    rpu = w.to_bytes()
+    payload = bytes([0x19]) + rpu + crc32_mpeg2(rpu).to_bytes(4, "big") + b'\x80'
+    return b'\x00\x00\x00\x01\x7c\x01' + escape(payload)
+
+def write_fixture(name, nals):
+    with open(os.path.join(FIXTURES, name), "wb") as f:
+        f.write(b"".join(nals))
+
+if __name__ == "__main__":
+    l6 = (1000, 400)
+    write_fixture("p81.bin", [
+        rpu_nal(False, True, (0, 3079, 1229), l6),
+        rpu_nal(False, False, (7, 2900, 1100), l6),
+        rpu_nal(False, True, (12, 3200, 1500), l6, use_prev=True)
+    ])
+    write_fixture("p7_fel.bin", [
+        rpu_nal(True, True, (0, 2081, 1024), (4000, 1200)),
+        rpu_nal(True, False, (2, 2600, 1300), (4000, 1200))
+    ])
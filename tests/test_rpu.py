@@ -0,0 +1,61 @@
+import os
+import pytest
+
+from redovi_rpu import (RpuError, count_rpu_frames, read_rpu_file, read_rpu_profile, validate_frame_alignment,
+                        validate_profile)
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+P81 = os.path.join(FIXTURES, "p81.bin") # 3 frames; the last reuses the previous mapping
+P7_FEL = os.path.join(FIXTURES, "p7_fel.bin") # 2 frames with NLQ residual data
+
+def test_count_frames():
+    assert count_rpu_frames(P81) == 3
+    assert count_rpu_frames(P7_FEL) == 2
+
+def test_profile_8_summary():
+    info = read_rpu_file(P81)
+    assert (info.frame_count, info.profile, info.scene_count) == (3, 8, 2)
+    assert (info.max_pq, info.max_avg_pq, info.max_cll, info.max_fall) == (3200, 1500, 1000, 400)
+    assert info.frames == []
+
+def test_profile_8_frames():
+    frames = read_rpu_file(P81, keep_frames=True).frames
+    assert [(f.min_pq, f.max_pq, f.avg_pq) for f in frames] == [(0, 3079, 1229), (7, 2900, 1100), (12, 3200, 1500)]
+    assert [f.scene_refresh for f in frames] == [True, False, True]
+
+def test_profile_7_fel():
+    info = read_rpu_file(P7_FEL, keep_frames=True)
+    assert (info.frame_count, info.profile, info.max_cll, info.max_fall) == (2, 7, 4000, 1200)
+    assert [(f.min_pq, f.max_pq, f.avg_pq) for f in info.frames] == [(0, 2081, 1024), (2, 2600, 1300)]
+
+def test_read_profile():
+    assert read_rpu_profile(P81) == 8
+    assert read_rpu_profile(P7_FEL) == 7
+
+def test_truncated_rpu(tmp_path):
+    path = tmp_path / "truncated.bin"
+    with open(P81, "rb") as f:
+        path.write_bytes(f.read()[:120])
+    assert count_rpu_frames(str(path)) == 1
+    with pytest.raises(RpuError):
+        read_rpu_file(str(path))
+
+def test_empty_file(tmp_path):
+    path = tmp_path / "empty.bin"
+    path.write_bytes(b"")
+    assert count_rpu_frames(str(path)) == 0
+    with pytest.raises(RpuError):
+        read_rpu_profile(str(path))
+
+def test_validate_profile():
+    assert validate_profile(8, 7) == 8
+    assert validate_profile(8, None) == 8
+    with pytest.raises(RpuError):
+        validate_profile(8, 5)
+    with pytest.raises(RpuError):
+        validate_profile(7, 7)
+
+def test_validate_frame_alignment():
+    assert validate_frame_alignment(P81, 3) == 3
+    with pytest.raises(RpuError):
+        validate_frame_alignment(P81, 4)